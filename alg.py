@@ -1,14 +1,30 @@
 # file for student recommendation algorithm (advanced feature)
+import copy
+import itertools
 import json
+import math
+import multiprocessing
 import os
+from array import array
+import pickle
+import threading
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
 import numpy as np
+from scipy import sparse
 from sqlalchemy import create_engine, text
 from sqlalchemy.engine import Result
-from sklearn.preprocessing import OneHotEncoder, MultiLabelBinarizer
-from sentence_transformers import SentenceTransformer
 from typing import Optional
+from embedding_cache import TextEmbeddingCache, DEFAULT_CACHE_PATH
+# sklearn / sentence_transformers / torch are imported where an encoder is fitted or
+# a model loaded, so importing this module (and app.py) stays cheap
+from model_registry import MODEL_NAME, get_model, model_id
+from ann import IVFIndex
+from snapshot import SnapshotStore
+from singleflight import SingleFlight
+from vector_storage import compact_block, dense_dot, dense_rows, take_rows
 # from database import db
-# from sklearn.decomposition import PCA
 # from sklearn.metrics.pairwise import cosine_similarity
 # from sklearn.feature_extraction.text import TfidfVectorizer
 # from scipy.sparse import hstack, csr_matrix, vstack
@@ -35,119 +51,462 @@ ALLOWED_WEIGHT_KEYS = set(DEFAULT_ALG_WEIGHTS.keys())
 
 # where embeddings will be stored
 EMBEDDING_TABLE = "StudentEmbeddings"
+ENCODER_TABLE = "StudentEncoders"
+NEIGHBOR_TABLE = "StudentNeighbors"
 
-# dimensions for PCA
-# PCA_DIMS = 32
+# neighbours per student per group kept by the precomputed table (neighbors.py)
+NEIGHBOR_K = int(os.environ.get("NEIGHBOR_K", "50"))
+
+# rows fetched per round trip when streaming the cohort
+STUDENT_LOAD_BATCH = int(os.environ.get("STUDENT_LOAD_BATCH", "2000"))
+
+# rows per multi-row INSERT when writing embeddings
+EMBEDDING_WRITE_CHUNK = int(os.environ.get("EMBEDDING_WRITE_CHUNK", "500"))
+
+# bumped whenever the stored blob / layout format changes (2 = dense + CSR parts)
+LAYOUT_FORMAT = 2
+
+# texts per SentenceTransformer forward pass when encoding the whole cohort
+EMBED_BATCH_SIZE = int(os.environ.get("EMBED_BATCH_SIZE", "256"))
+
+# worker processes encoding shards of the cohort on a full rebuild (1 = in this process),
+# torch intra-op threads each (0 = cores / processes), and the smallest shard worth a process
+REBUILD_PROCESSES = int(os.environ.get("REBUILD_PROCESSES", "1"))
+REBUILD_TORCH_THREADS = int(os.environ.get("REBUILD_TORCH_THREADS", "0"))
+REBUILD_MIN_SHARD = int(os.environ.get("REBUILD_MIN_SHARD", "500"))
+
+# directory for the memory-mapped snapshot shared by all worker processes ("" disables)
+SNAPSHOT_DIR = os.environ.get(
+    "SNAPSHOT_DIR",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "snapshots")
+)
+
+# top-k queries switch from exact scoring to the IVF index (ann.py) at this cohort size
+ANN_MIN_STUDENTS = int(os.environ.get("ANN_MIN_STUDENTS", "20000"))
+ANN_N_PROBE = int(os.environ.get("ANN_N_PROBE", "8"))
+
+# relative idf change (running label counts vs the idf baked into stored vectors)
+# at which the background worker re-weights every row (refresh_label_weights)
+IDF_DRIFT_THRESHOLD = float(os.environ.get("IDF_DRIFT_THRESHOLD", "0.05"))
+
+# multi-label encoders with rarity weighting: (encoder key, idf key, running count key)
+IDF_LABELS = (
+    ("courses", "course_idf", "course_counts"),
+    ("clubs", "club_idf", "club_counts"),
+    ("internships", "internship_idf", "internship_counts"),
+)
+
+# optional compression of each group's label columns (courses, clubs, internships,
+# hometown, dorm) to a fixed width: "svd" (TruncatedSVD), "random" (sparse random
+# projection) or "" to keep the full vocabulary width
+REDUCE_METHOD = os.environ.get("REDUCE_METHOD", "")
+REDUCE_DIMS = int(os.environ.get("REDUCE_DIMS", "32"))
 
 # db engine instance --> UPDATE: switched to passing in engine directly in app.py
 # engine = create_engine(DATABASE_URI, future=True)
 
-# -- MySQL functions -- (currently unused)
+# -- MySQL functions --
+def _has_legacy_embeddings(conn):
+    return bool(conn.execute(text(
+        "SELECT COUNT(*) FROM information_schema.COLUMNS "
+        "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = :t AND COLUMN_NAME = 'vector'"
+    ), {"t": EMBEDDING_TABLE}).scalar())
+
+def migrate_embeddings_table(engine):
+    # explicit step (python migrate.py): drop the old JSON-vector table, never read
+    # by anything, so ensure_embeddings_table can create the blob layout
+    with engine.begin() as conn:
+        if not _has_legacy_embeddings(conn):
+            return False
+        conn.execute(text(f"DROP TABLE {EMBEDDING_TABLE}"))
+    print(f"[alg] Dropped legacy {EMBEDDING_TABLE} (JSON vectors)")
+    return True
+
 def ensure_embeddings_table(engine):
-    create_sql = f"""
-    CREATE TABLE IF NOT EXISTS {EMBEDDING_TABLE} (
-        NDID CHAR(9) PRIMARY KEY,
-        vector JSON NOT NULL
-    );
-    """
+    # one float32 blob per group per student, tagged with the encoder version
+    # that produced it; layouts of each version live in ENCODER_TABLE
     with engine.begin() as conn:
-        conn.execute(text(create_sql))
+        if _has_legacy_embeddings(conn):
+            raise RuntimeError(
+                f"{EMBEDDING_TABLE} still has the legacy JSON layout; run `python migrate.py` first"
+            )
+
+        conn.execute(text(f"""
+        CREATE TABLE IF NOT EXISTS {EMBEDDING_TABLE} (
+            NDID CHAR(9) PRIMARY KEY,
+            encoder_version VARCHAR(40) NOT NULL,
+            academics MEDIUMBLOB NOT NULL,
+            professional MEDIUMBLOB NOT NULL,
+            background MEDIUMBLOB NOT NULL
+        );
+        """))
+        conn.execute(text(f"""
+        CREATE TABLE IF NOT EXISTS {ENCODER_TABLE} (
+            encoder_version VARCHAR(40) PRIMARY KEY,
+            layout JSON NOT NULL,
+            encoders LONGBLOB NOT NULL,
+            created_at TIMESTAMP(6) NOT NULL DEFAULT CURRENT_TIMESTAMP(6)
+        );
+        """))
+        conn.execute(text(f"""
+        CREATE TABLE IF NOT EXISTS {NEIGHBOR_TABLE} (
+            NDID CHAR(9) NOT NULL,
+            feature_group VARCHAR(16) NOT NULL,
+            neighbor_rank SMALLINT NOT NULL,
+            neighbor_NDID CHAR(9) NOT NULL,
+            score FLOAT NOT NULL,
+            encoder_version VARCHAR(40) NOT NULL,
+            PRIMARY KEY (NDID, feature_group, neighbor_rank)
+        );
+        """))
+
+class StudentTable:
+    """
+    Columnar cohort built by load_student_table. Each field keeps its distinct
+    strings once (vocab) and per-student integer ids; list fields (courses,
+    internships, clubs) are flattened with a start offset per student.
+    Iterating yields the same dicts load_students always returned.
+    """
 
-def load_students(engine):
-    students = {}
+    SCALAR_FIELDS = ("major", "minor", "hometown", "dorm")
+    LIST_FIELDS = ("courses", "internships", "clubs")
+
+    def __init__(self):
+        self.ndids = []
+        self.vocab = {f: [] for f in self.SCALAR_FIELDS + self.LIST_FIELDS}
+        self._ids = {f: {} for f in self.vocab}
+        self._scalars = {f: array("i") for f in self.SCALAR_FIELDS}
+        self._starts = {f: array("q") for f in self.LIST_FIELDS}
+        self._labels = {f: array("i") for f in self.LIST_FIELDS}
+
+    def _intern(self, field, value):
+        ids = self._ids[field]
+        i = ids.get(value)
+        if i is None:
+            i = ids[value] = len(self.vocab[field])
+            self.vocab[field].append(value)
+        return i
+
+    def add_student(self, ndid, major, minor, hometown, dorm):
+        self.ndids.append(ndid)
+        for field, value in zip(self.SCALAR_FIELDS, (major, minor, hometown, dorm)):
+            self._scalars[field].append(self._intern(field, value or ""))
+        for field in self.LIST_FIELDS:
+            self._starts[field].append(len(self._labels[field]))
+
+    def add_label(self, field, value):
+        # belongs to the most recently added student
+        self._labels[field].append(self._intern(field, value))
+
+    def __len__(self):
+        return len(self.ndids)
+
+    def labels(self, field, i):
+        start = self._starts[field][i]
+        end = self._starts[field][i + 1] if i + 1 < len(self.ndids) else len(self._labels[field])
+        vocab = self.vocab[field]
+        return [vocab[j] for j in self._labels[field][start:end]]
+
+    def record(self, i):
+        student = {"NDID": self.ndids[i]}
+        for field in self.SCALAR_FIELDS:
+            student[field] = self.vocab[field][self._scalars[field][i]]
+        for field in self.LIST_FIELDS:
+            student[field] = self.labels(field, i)
+        return student
+
+    def __iter__(self):
+        for i in range(len(self.ndids)):
+            yield self.record(i)
+
+def load_student_table(engine, ndid=None):
+    # one round trip: Student rows and their course/internship/club rows in a
+    # single UNION ALL ordered by (NDID, kind), streamed with a server-side cursor
+    where = " WHERE NDID = :NDID" if ndid else ""
+    fk_where = " WHERE FK_NDID = :NDID" if ndid else ""
+    params = {"NDID": ndid} if ndid else {}
+
+    q = text(f"""
+        SELECT NDID, 0 AS kind, major AS v1, minor AS v2, hometown AS v3, dorm AS v4 FROM Student{where}
+        UNION ALL SELECT FK_NDID, 1, FK_CRN, NULL, NULL, NULL FROM StudentTakesCourse{fk_where}
+        UNION ALL SELECT FK_NDID, 2, company, NULL, NULL, NULL FROM Internship{fk_where}
+        UNION ALL SELECT FK_NDID, 3, FK_club_name, NULL, NULL, NULL FROM StudentInClub{fk_where}
+        ORDER BY 1, 2
+    """)
+    list_fields = {1: "courses", 2: "internships", 3: "clubs"}
+
+    table = StudentTable()
+    current = None
     with engine.connect() as conn:
-        q = text("SELECT NDID, major, minor, hometown, dorm FROM Student")
-        res: Result = conn.execute(q)
-        for row in res.mappings():
-            ndid = row["NDID"]
-            students[ndid] = {
-                "NDID": ndid,
-                "major": row.get("major") or "",
-                "minor": row.get("minor") or "",
-                "hometown": row.get("hometown") or "",
-                "dorm": row.get("dorm") or "",
-                "clubs": [],
-                "courses": [],
-                "internships": [],
-            }
+        res: Result = conn.execution_options(stream_results=True, yield_per=STUDENT_LOAD_BATCH).execute(q, params)
+        for row_ndid, kind, v1, v2, v3, v4 in res:
+            if kind == 0:
+                table.add_student(row_ndid, v1, v2, v3, v4)
+                current = row_ndid
+                continue
+            if row_ndid != current or not v1:
+                continue  # orphaned row (no Student) or empty value
+            if kind == 3:
+                v1 = v1.strip().lower()
+                if not v1:
+                    continue
+            table.add_label(list_fields[kind], v1)
 
-        # loading courses -> storing in students dict
-        q_courses = text(
-            "SELECT s.FK_NDID as NDID, s.FK_CRN as crn FROM StudentTakesCourse s"
-        )
-        res = conn.execute(q_courses)
-        for row in res.mappings():
-            ndid = row["NDID"]
-            crn = row["crn"]
-            if ndid in students and crn:
-                students[ndid]["courses"].append(crn)
-
-        # loading internships
-        q_intern = text("SELECT FK_NDID as NDID, company FROM Internship")
-        res = conn.execute(q_intern)
-        for row in res.mappings():
-            ndid = row["NDID"]
-            comp = row["company"]
-            if ndid in students and comp:
-                students[ndid]["internships"].append(comp)
-
-        # loading clubs
-        q_clubs = text("SELECT FK_NDID as NDID, FK_club_name as club_name FROM StudentInClub")
-        res = conn.execute(q_clubs)
-        for row in res.mappings():
-            ndid = row["NDID"]
-            club_name = row["club_name"]
-            club_name = club_name.strip().lower()
-            if ndid in students and club_name:
-                students[ndid]["clubs"].append(club_name)
-
-        all_students = [students[k] for k in sorted(students.keys())]
-        return all_students
-
-def save_embeddings_to_db(students, reduced_student_vectors, engine, table_name="student_embeddings"):
-    insert_sql = text(f"""
-        INSERT INTO {table_name} (NDID, vector)
-        VALUES (:NDID, :vector)
-        ON DUPLICATE KEY UPDATE vector = :vector;
+    return table
+
+def load_students(engine, ndid=None):
+    # ndid -> only load that one student (incremental encoding)
+    return list(load_student_table(engine, ndid=ndid))
+
+def save_encoders_to_db(encoders, engine):
+    # fitted encoders (without the model / label index / edit log) + column layout, keyed by version
+    state = {k: v for k, v in encoders.items() if k not in ("model", "labels", "touched")}
+    query = text(f"""
+        INSERT INTO {ENCODER_TABLE} (encoder_version, layout, encoders)
+        VALUES (:version, :layout, :encoders)
+        ON DUPLICATE KEY UPDATE layout = :layout, encoders = :encoders
     """)
+    with engine.begin() as conn:
+        conn.execute(query, {
+            "version": encoders["version"],
+            "layout": json.dumps(_segment_widths(encoders)),
+            "encoders": pickle.dumps(state, protocol=pickle.HIGHEST_PROTOCOL),
+        })
 
+def prune_encoders_in_db(encoders, engine):
+    # after a full write only layouts of the current fit are still referenced
     with engine.begin() as conn:
-        for student, v in zip(students, reduced_student_vectors):
-            ndid = student["NDID"]
-            v_json = json.dumps(v.tolist())
+        conn.execute(
+            text(f"DELETE FROM {ENCODER_TABLE} WHERE encoder_version NOT LIKE :prefix"),
+            {"prefix": encoders["fit_id"] + ".%"},
+        )
 
-            conn.execute(insert_sql, {
-                "NDID": ndid,
-                "vector": v_json
-            })
+def load_encoders_from_db(engine):
+    # most recently written encoders, or None if nothing is stored yet
+    query = text(f"SELECT encoders FROM {ENCODER_TABLE} ORDER BY created_at DESC LIMIT 1")
+    with engine.connect() as conn:
+        row = conn.execute(query).fetchone()
+    if not row:
+        return None
+    encoders = pickle.loads(row[0])
+    encoders["model"] = get_model(MODEL_NAME)
+    return encoders
 
-def load_student_embedding(ndid, engine, table_name="StudentEmbeddings"):
+def _pack_row(block, i):
+    # blob = dense float32 values, then the CSR row's int32 column indices and float32 values
+    S = block["sparse"]
+    start, end = S.indptr[i], S.indptr[i + 1]
+    return (
+        dense_rows(block, i).astype(np.float32).tobytes()
+        + S.indices[start:end].astype(np.int32).tobytes()
+        + S.data[start:end].astype(np.float32).tobytes()
+    )
+
+def _unpack_row(blob, dense_width):
+    dense = np.frombuffer(blob, dtype=np.float32, count=dense_width)
+    nnz = (len(blob) - 4 * dense_width) // 8
+    indices = np.frombuffer(blob, dtype=np.int32, count=nnz, offset=4 * dense_width)
+    values = np.frombuffer(blob, dtype=np.float32, count=nnz, offset=4 * (dense_width + nnz))
+    return dense, indices, values
+
+def _unpack_rows(blobs, group_layout):
+    # stored blobs (one layout) -> {"dense", "sparse"} block
+    dense_width = sum(w for _, w in group_layout["dense"])
+    sparse_width = sum(w for _, w in group_layout["sparse"])
+    dense, indices, values, indptr = [], [], [], [0]
+    for blob in blobs:
+        d, idx, vals = _unpack_row(blob, dense_width)
+        dense.append(d)
+        indices.append(idx)
+        values.append(vals)
+        indptr.append(indptr[-1] + len(idx))
+
+    n = len(blobs)
+    S = sparse.csr_matrix(
+        (
+            np.concatenate(values) if n else np.zeros(0, dtype=np.float32),
+            np.concatenate(indices) if n else np.zeros(0, dtype=np.int32),
+            np.array(indptr),
+        ),
+        shape=(n, sparse_width),
+    )
+    D = np.vstack(dense) if n else np.zeros((0, dense_width), dtype=np.float32)
+    return {"dense": D, "sparse": S}
+
+def _embedding_rows(matrices, encoders, ndids):
+    for ndid in ndids:
+        i = matrices["rows"][ndid]
+        row = {"NDID": ndid, "version": encoders["version"]}
+        for group in SIMILARITY_GROUPS:
+            row[group] = _pack_row(matrices[group], i)
+        yield row
+
+def _write_chunks(conn, insert_sql, rows, chunk_size):
+    # executemany per chunk -> pymysql turns each into one multi-row INSERT
+    written = 0
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) >= chunk_size:
+            conn.execute(insert_sql, chunk)
+            written += len(chunk)
+            chunk = []
+    if chunk:
+        conn.execute(insert_sql, chunk)
+        written += len(chunk)
+    return written
+
+def save_embeddings_to_db(matrices, encoders, engine, ndids=None, chunk_size=EMBEDDING_WRITE_CHUNK):
+    # ndids given -> upsert just those rows in place.
+    # ndids None (full cohort) -> fill a staging table and swap it in with one
+    # atomic RENAME, so readers never see a half-written table
+    t0 = time.perf_counter()
+    columns = "(NDID, encoder_version, academics, professional, background)"
+    values = "VALUES (:NDID, :version, :academics, :professional, :background)"
+
+    if ndids is not None:
+        # VALUES(col) instead of repeating bind params: pymysql only batches the VALUES tuple
+        insert_sql = text(f"""
+            INSERT INTO {EMBEDDING_TABLE} {columns} {values}
+            ON DUPLICATE KEY UPDATE encoder_version = VALUES(encoder_version), academics = VALUES(academics),
+                professional = VALUES(professional), background = VALUES(background)
+        """)
+        with engine.begin() as conn:
+            written = _write_chunks(conn, insert_sql, _embedding_rows(matrices, encoders, ndids), chunk_size)
+    else:
+        staging = f"{EMBEDDING_TABLE}_staging"
+        retired = f"{EMBEDDING_TABLE}_old"
+        with engine.begin() as conn:
+            conn.execute(text(f"DROP TABLE IF EXISTS {staging}"))
+            conn.execute(text(f"CREATE TABLE {staging} LIKE {EMBEDDING_TABLE}"))
+        with engine.begin() as conn:
+            insert_sql = text(f"INSERT INTO {staging} {columns} {values}")
+            written = _write_chunks(conn, insert_sql, _embedding_rows(matrices, encoders, matrices["ndids"]), chunk_size)
+        with engine.begin() as conn:
+            conn.execute(text(f"DROP TABLE IF EXISTS {retired}"))
+            conn.execute(text(
+                f"RENAME TABLE {EMBEDDING_TABLE} TO {retired}, {staging} TO {EMBEDDING_TABLE}"
+            ))
+            conn.execute(text(f"DROP TABLE {retired}"))
+
+    seconds = time.perf_counter() - t0
+    stats = {
+        "rows": written,
+        "seconds": seconds,
+        "rows_per_sec": written / seconds if seconds > 0 else 0.0,
+    }
+    if ndids is None:
+        print(f"[alg] Wrote {written} embeddings in {seconds:.3f}s ({stats['rows_per_sec']:.0f} rows/s)")
+    return stats
+
+def delete_embedding_from_db(ndid, engine):
+    with engine.begin() as conn:
+        conn.execute(text(f"DELETE FROM {EMBEDDING_TABLE} WHERE NDID = :NDID"), {"NDID": ndid})
+
+def _neighbor_rows(neighbors, ndids, version):
+    for group, (idx, scores) in neighbors.items():
+        for i, ndid in enumerate(ndids):
+            for rank, (j, score) in enumerate(zip(idx[i], scores[i])):
+                if j < 0:
+                    break
+                yield {
+                    "NDID": ndid, "group": group, "rank": rank,
+                    "neighbor": ndids[j], "score": float(score), "version": version,
+                }
+
+def save_neighbors_to_db(neighbors, ndids, version, engine, chunk_size=EMBEDDING_WRITE_CHUNK):
+    # replaces the whole table through a staging copy, like save_embeddings_to_db.
+    # version = neighbor_stamp() of the encoders the neighbours were computed with
+    # (kept in the encoder_version column), see stored_neighbors
+    t0 = time.perf_counter()
+    staging = f"{NEIGHBOR_TABLE}_staging"
+    retired = f"{NEIGHBOR_TABLE}_old"
+    with engine.begin() as conn:
+        conn.execute(text(f"DROP TABLE IF EXISTS {staging}"))
+        conn.execute(text(f"CREATE TABLE {staging} LIKE {NEIGHBOR_TABLE}"))
+    with engine.begin() as conn:
+        insert_sql = text(f"""
+            INSERT INTO {staging} (NDID, feature_group, neighbor_rank, neighbor_NDID, score, encoder_version)
+            VALUES (:NDID, :group, :rank, :neighbor, :score, :version)
+        """)
+        written = _write_chunks(conn, insert_sql, _neighbor_rows(neighbors, ndids, version), chunk_size)
+    with engine.begin() as conn:
+        conn.execute(text(f"DROP TABLE IF EXISTS {retired}"))
+        conn.execute(text(f"RENAME TABLE {NEIGHBOR_TABLE} TO {retired}, {staging} TO {NEIGHBOR_TABLE}"))
+        conn.execute(text(f"DROP TABLE {retired}"))
+    return {"rows": written, "seconds": time.perf_counter() - t0}
+
+def load_neighbors(ndid, engine, group="default", k=NEIGHBOR_K):
+    # (neighbor_stamp of the batch, [(neighbor ndid, score)] best first) from the
+    # precomputed table; (None, []) when ndid has no rows
+    query = text(f"""
+        SELECT neighbor_NDID, score, encoder_version FROM {NEIGHBOR_TABLE}
+        WHERE NDID = :NDID AND feature_group = :group
+        ORDER BY neighbor_rank LIMIT :k
+    """)
+    with engine.connect() as conn:
+        rows = conn.execute(query, {"NDID": ndid, "group": group, "k": k}).fetchall()
+    if not rows:
+        return None, []
+    return rows[0][2], [(r[0], float(r[1])) for r in rows]
+
+def load_student_embedding(ndid, engine):
     query = text(f"""
-        SELECT vector FROM {table_name}
-        WHERE NDID = :NDID
+        SELECT e.academics, e.professional, e.background, v.layout
+        FROM {EMBEDDING_TABLE} e
+        JOIN {ENCODER_TABLE} v ON v.encoder_version = e.encoder_version
+        WHERE e.NDID = :NDID
     """)
 
     with engine.connect() as conn:
         res = conn.execute(query, {"NDID": ndid}).fetchone()
-    
+
     if not res:
         return None
-    
-    return np.array(json.loads(res[0]))
 
-def load_student_embeddings(engine, table_name="StudentEmbeddings"):
-    query = text(f"SELECT NDID, vector FROM {table_name}")
+    layout = json.loads(res[3])
+    return {group: _unpack_rows([blob], layout[group]) for group, blob in zip(SIMILARITY_GROUPS, res[:3])}
 
-    ndids = []
-    vectors = []
+def load_student_embeddings(engine, encoders):
+    # stored rows -> similarity matrices in the current encoders' layout.
+    # rows written before later vocabulary extensions get their sparse columns
+    # shifted into place; rows from a different fit are skipped (they get
+    # re-encoded on demand)
+    fit_id = encoders["fit_id"]
+    target = _segment_widths(encoders)
 
     with engine.connect() as conn:
-        res = conn.execute(query)
-        for row in res.mappings():
-            ndids.append(row["NDID"])
-            vectors.append(json.loads(row["vector"]))
+        layouts = {
+            version: json.loads(layout)
+            for version, layout in conn.execute(text(f"SELECT encoder_version, layout FROM {ENCODER_TABLE}"))
+        }
+        res = conn.execute(text(
+            f"SELECT NDID, encoder_version, academics, professional, background "
+            f"FROM {EMBEDDING_TABLE} ORDER BY NDID"
+        ))
+        by_version = {}
+        for ndid, version, *blobs in res:
+            if version.split(".")[0] != fit_id or version not in layouts:
+                continue
+            by_version.setdefault(version, []).append((ndid, blobs))
 
-    return ndids, np.array(vectors)
+    ndids = []
+    blocks = {group: [] for group in SIMILARITY_GROUPS}
+    for version, rows in by_version.items():
+        ndids.extend(ndid for ndid, _ in rows)
+        for g, group in enumerate(SIMILARITY_GROUPS):
+            layout = layouts[version][group]
+            block = _unpack_rows([blobs[g] for _, blobs in rows], layout)
+            block["sparse"] = _pad_sparse(block["sparse"], layout["sparse"], target[group]["sparse"])
+            blocks[group].append(block)
+
+    matrices = {"ndids": ndids, "rows": {ndid: i for i, ndid in enumerate(ndids)}}
+    for group in SIMILARITY_GROUPS:
+        if ndids:
+            matrices[group] = stack_blocks(blocks[group])
+        else:
+            matrices[group] = _unpack_rows([], target[group])
+    return matrices
 
 # -- User Weight Functions --
 def load_user_weights(ndid, engine):
@@ -197,23 +556,25 @@ def save_user_weights(ndid, weights, engine):
 
 # -- Algorithm functions --
 def fit_encoders(students):
-    # load sentence transformer model (pretrained)
-    model = SentenceTransformer("all-MiniLM-L6-v2")
+    from sklearn.preprocessing import OneHotEncoder, MultiLabelBinarizer
+
+    # sentence transformer model (pretrained), loaded once per process by the registry
+    model = get_model(MODEL_NAME)
 
     # 1. build vectors -> embedding plan on google doc
     hometowns = [[student["hometown"]] for student in students]
     dorms = [[student["dorm"]] for student in students]
     
-    hometown_encoder = OneHotEncoder(handle_unknown="ignore", sparse_output=False)
-    dorm_encoder = OneHotEncoder(handle_unknown="ignore", sparse_output=False)
+    hometown_encoder = OneHotEncoder(handle_unknown="ignore", sparse_output=True)
+    dorm_encoder = OneHotEncoder(handle_unknown="ignore", sparse_output=True)
 
     clubs = [student["clubs"] for student in students]
     courses = [student["courses"] for student in students]
     internships = [student["internships"] for student in students]
 
-    clubs_mlb = MultiLabelBinarizer()
-    courses_mlb = MultiLabelBinarizer()
-    internships_mlb = MultiLabelBinarizer()
+    clubs_mlb = MultiLabelBinarizer(sparse_output=True)
+    courses_mlb = MultiLabelBinarizer(sparse_output=True)
+    internships_mlb = MultiLabelBinarizer(sparse_output=True)
 
     # 2. fit on full data set -> ex: MLB.fit
     hometown_encoder.fit(hometowns)
@@ -244,16 +605,246 @@ def fit_encoders(students):
         "internships": internships_mlb,
         "course_idf": course_idf,
         "club_idf": club_idf,
-        "internship_idf": internship_idf
+        "internship_idf": internship_idf,
+        "n_students": N,
+        # running label counts + each student's labels, kept current on every
+        # insert/edit/delete; the *_idf arrays are what stored vectors were built with
+        "course_counts": course_counts.astype(np.int64),
+        "club_counts": club_counts.astype(np.int64),
+        "internship_counts": internship_counts.astype(np.int64),
+        "labels": {s["NDID"]: _student_labels(s) for s in students},
+        # fit_id changes on every full fit; version also counts vocabulary extensions
+        "fit_id": uuid.uuid4().hex[:16],
+        "extensions": 0,
+        "layout_format": LAYOUT_FORMAT,
     }
+    encoders.update(_new_edit_log())
+    encoders["version"] = f"{encoders['fit_id']}.0"
+    encoders["reducers"] = fit_reducers(students, encoders) if REDUCE_METHOD else {}
 
     return encoders
 
+def _student_labels(student):
+    return tuple(tuple(student[key]) for key, _, _ in IDF_LABELS)
+
+def current_idf(encoders):
+    # {idf key: idf implied by the running counts}
+    n = encoders["n_students"]
+    out = {}
+    for _, idf_key, count_key in IDF_LABELS:
+        counts = encoders[count_key]
+        out[idf_key] = np.log(n / (1 + counts)) if n > 0 else np.zeros(len(counts))
+    return out
+
+def idf_drift(encoders=None):
+    # largest relative L1 change between applied and current idf over the three label sets
+    encoders = encoders if encoders is not None else _STATE["encoders"]
+    if encoders is None or "course_counts" not in encoders:
+        return 0.0
+    worst = 0.0
+    for idf_key, idf in current_idf(encoders).items():
+        applied = encoders[idf_key]
+        denom = np.abs(applied).sum()
+        if denom > 0:
+            worst = max(worst, float(np.abs(idf - applied).sum() / denom))
+    return worst
+
+def _count_labels(encoders, labels, sign):
+    # caller passes encoders whose count arrays it owns (copied)
+    for (key, _, count_key), values in zip(IDF_LABELS, labels):
+        if values:
+            cols = encoders[key].transform([list(values)]).indices
+            encoders[count_key][cols] += sign
+
+def _track_labels(encoders, ndid, labels):
+    # copy of encoders with ndid's labels (None = deleted) reflected in the running counts
+    if "labels" not in encoders:
+        return encoders
+    updated = dict(encoders)
+    for _, _, count_key in IDF_LABELS:
+        updated[count_key] = encoders[count_key].copy()
+    updated["labels"] = dict(encoders["labels"])
+
+    old = updated["labels"].pop(ndid, None)
+    if old is not None:
+        _count_labels(updated, old, -1)
+        updated["n_students"] -= 1
+    if labels is not None:
+        _count_labels(updated, labels, +1)
+        updated["labels"][ndid] = labels
+        updated["n_students"] += 1
+    return updated
+
+def _new_edit_log():
+    # which students changed since a given point, for consumers of whole-cohort results
+    # (the neighbour table): edits counts per-student updates, touched maps ndid ->
+    # edit number of its last re-encode / insert / delete, oldest first. A fresh
+    # edit_epoch starts a history nothing computed earlier can be checked against
+    return {"edit_epoch": uuid.uuid4().hex[:8], "edits": 0, "touched": {}, "label_refresh": 0}
+
+def _touch(encoders, ndids=()):
+    # copy of encoders with one more edit, covering ndids
+    updated = dict(encoders)
+    updated["edits"] = encoders.get("edits", 0) + 1
+    updated["touched"] = dict(encoders.get("touched", {}))
+    for ndid in ndids:
+        updated["touched"].pop(ndid, None)  # keep touched in edit order
+        updated["touched"][ndid] = updated["edits"]
+    return updated
+
+def changed_since(encoders, edits):
+    # ndids touched after edit number `edits` (newest first, O(changed))
+    changed = []
+    for ndid, edit in reversed(encoders.get("touched", {}).items()):
+        if edit <= edits:
+            break
+        changed.append(ndid)
+    return changed
+
+def neighbor_stamp(encoders):
+    # tags a batch of neighbours (neighbors.py) with the edit it was computed at
+    return f"{encoders.get('edit_epoch')}.{encoders.get('edits', 0)}"
+
+def _label_blocks(students, encoders):
+    # {group: CSR} of the one-hot / multi-label columns, as they enter each block
+    hometowns, dorms, clubs, courses, internships = [], [], [], [], []
+    for student in students:
+        hometowns.append([student["hometown"]])
+        dorms.append([student["dorm"]])
+        clubs.append(student["clubs"])
+        courses.append(student["courses"])
+        internships.append(student["internships"])
+
+    hometown_vec = _normalize_rows(encoders["hometown"].transform(hometowns))
+    dorm_vec = _normalize_rows(encoders["dorm"].transform(dorms))
+    clubs_vec = _normalize_rows(_scale_columns(encoders["clubs"].transform(clubs), encoders["club_idf"]))
+    courses_vec = _normalize_rows(_scale_columns(encoders["courses"].transform(courses), encoders["course_idf"]))
+    internships_vec = _normalize_rows(
+        _scale_columns(encoders["internships"].transform(internships), encoders["internship_idf"])
+    )
+    return {
+        "academics": sparse.hstack([courses_vec], format="csr"),
+        "professional": sparse.hstack([clubs_vec, internships_vec], format="csr"),
+        "background": sparse.hstack([hometown_vec, dorm_vec], format="csr"),
+    }
+
+def fit_reducers(students, encoders, method=REDUCE_METHOD, dims=REDUCE_DIMS):
+    # per group: projection of its label columns down to `dims` dense columns.
+    # groups already narrower than that (or tiny cohorts) are left as they are
+    from sklearn.decomposition import TruncatedSVD
+    from sklearn.random_projection import SparseRandomProjection
+
+    widths = _raw_segment_widths(encoders)
+    reducers = {}
+    for group, S in _label_blocks(students, encoders).items():
+        if S.shape[1] <= dims or S.shape[0] <= dims:
+            continue
+        if method == "svd":
+            components = TruncatedSVD(n_components=dims, random_state=0).fit(S).components_.T.astype(np.float32)
+        elif method == "random":
+            srp = SparseRandomProjection(n_components=dims, dense_output=True, random_state=0).fit(S)
+            components = sparse.csr_matrix(srp.components_.T, dtype=np.float32)
+        else:
+            raise ValueError(f"Unknown REDUCE_METHOD: {method}")
+        reducers[group] = {"method": method, "components": components, "segments": widths[group]["sparse"]}
+    return reducers
+
+def _truncate_sparse(S, current_segments, fitted_segments):
+    # inverse of _pad_sparse: drop columns appended to each segment after the fit
+    cur_w = np.array([w for _, w in current_segments])
+    fit_w = np.array([w for _, w in fitted_segments])
+    if np.array_equal(cur_w, fit_w):
+        return S
+    cur_start = np.concatenate([[0], np.cumsum(cur_w)[:-1]])
+    fit_start = np.concatenate([[0], np.cumsum(fit_w)[:-1]])
+    S = S.tocsr()
+    seg = np.repeat(np.arange(len(cur_w)), cur_w)[S.indices]
+    offset = S.indices - cur_start[seg]
+    keep = offset < fit_w[seg]
+    rows = np.repeat(np.arange(S.shape[0]), np.diff(S.indptr))
+    return sparse.csr_matrix(
+        (S.data[keep], (rows[keep], fit_start[seg][keep] + offset[keep])),
+        shape=(S.shape[0], int(fit_w.sum())),
+    )
+
+def reduce_blocks(blocks, encoders):
+    # replace reduced groups' sparse label columns by their projection (dense);
+    # groups not in `blocks` are left to the caller
+    reducers = encoders.get("reducers") or {}
+    if not reducers:
+        return blocks
+    raw = _raw_segment_widths(encoders)
+    out = dict(blocks)
+    for group, reducer in reducers.items():
+        if group not in blocks:
+            continue
+        block = blocks[group]
+        S = _truncate_sparse(block["sparse"], raw[group]["sparse"], reducer["segments"])
+        projected = S @ reducer["components"]
+        projected = projected.toarray() if sparse.issparse(projected) else np.asarray(projected)
+        n = block["dense"].shape[0]
+        out[group] = {
+            "dense": np.hstack([block["dense"], projected.reshape(n, -1)]),
+            "sparse": sparse.csr_matrix((n, 0)),
+        }
+    return out
+
+# -- Text embedding cache --
+_TEXT_CACHE = None
+
+def get_text_cache():
+    # shared on-disk cache, opened on first use (EMBEDDING_CACHE_PATH="" disables it)
+    global _TEXT_CACHE
+    if _TEXT_CACHE is None and DEFAULT_CACHE_PATH:
+        _TEXT_CACHE = TextEmbeddingCache(DEFAULT_CACHE_PATH)
+    return _TEXT_CACHE
+
+def model_identity(model):
+    # cache key for whichever model produced an embedding
+    return model_id(model)
+
+# helper for batched, deduplicated encoding -> {text: embedding}
+def embed_texts(model, texts, batch_size=EMBED_BATCH_SIZE):
+    unique = list(dict.fromkeys(texts))
+    if not unique:
+        return {}
+
+    # the cache is best effort: any error (e.g. "database is locked" while rebuild
+    # shards write at once) falls back to the model
+    model_id = model_identity(model)
+    try:
+        cache = get_text_cache()
+        found = cache.get_many(model_id, unique) if cache is not None else {}
+    except Exception as e:
+        print(f"[alg] Text embedding cache read failed: {e}")
+        cache, found = None, {}
+
+    missing = [t for t in unique if t not in found]
+    if missing:
+        embeddings = model.encode(missing, batch_size=batch_size)
+        computed = dict(zip(missing, embeddings))
+        if cache is not None:
+            try:
+                cache.put_many(model_id, computed)
+            except Exception as e:
+                print(f"[alg] Text embedding cache write failed: {e}")
+        found.update(computed)
+
+    return found
+
+# helper for single text embedding (uses precomputed lookup when available)
+def embed_one(model, text, lookup=None):
+    if lookup is not None and text in lookup:
+        return lookup[text]
+    return embed_texts(model, [text])[text]
+
 # helper for average embedding (for clubs and internships)
-def embed_avg(model, texts):
+def embed_avg(model, texts, lookup=None):
     if not texts:
         return np.zeros(model.get_sentence_embedding_dimension())
-    embeddings = model.encode(texts)
+    if lookup is None or not all(t in lookup for t in texts):
+        lookup = embed_texts(model, texts)
+    embeddings = [lookup[t] for t in texts]
     return np.mean(embeddings, axis=0)
 
 # helper for group normalization
@@ -261,51 +852,258 @@ def normalize_vec(vec):
     norm = np.linalg.norm(vec)
     return vec if norm == 0 else vec / norm
 
-def encode_student(student, encoders):
+# -- Dense + sparse group blocks --
+# each similarity group is a dense part (sentence embeddings) and a CSR part
+# (one-hot / multi-label columns), so memory grows with non-zeros, not vocabulary
+def _scale_columns(S, weights):
+    # rarity weighting without densifying: multiply each stored value by its column idf
+    S = S.tocsr().astype(np.float64)
+    S.data *= weights[S.indices]
+    return S
+
+def _normalize_rows(S):
+    # per-row unit norm for a CSR block (zero rows stay zero)
+    S = S.tocsr().astype(np.float64)
+    norms = np.sqrt(np.asarray(S.multiply(S).sum(axis=1)).ravel())
+    norms[norms == 0] = 1.0
+    S.data /= np.repeat(norms, np.diff(S.indptr))
+    return S
+
+def _block(dense_parts, sparse_parts, n_rows=1):
+    dense = np.hstack(dense_parts) if dense_parts else np.zeros((n_rows, 0))
+    return {
+        "dense": dense.reshape(n_rows, -1),
+        "sparse": sparse.hstack(sparse_parts, format="csr"),
+    }
+
+def normalize_block(block):
+    # unit-length rows over dense + sparse columns together
+    D, S = block["dense"], block["sparse"]
+    norms = np.sqrt(np.einsum("ij,ij->i", D, D) + np.asarray(S.multiply(S).sum(axis=1)).ravel())
+    norms[norms == 0] = 1.0  # zero rows stay zero -> cosine 0 like compute_cosine
+    S = S.tocsr().astype(np.float64)
+    S.data /= np.repeat(norms, np.diff(S.indptr))
+    return {"dense": D / norms[:, None], "sparse": S}
+
+def stack_blocks(blocks):
+    if not blocks:
+        return {"dense": np.zeros((0, 0)), "sparse": sparse.csr_matrix((0, 0))}
+    stacked = {
+        "dense": np.vstack([b["dense"] for b in blocks]),
+        "sparse": sparse.vstack([b["sparse"] for b in blocks], format="csr"),
+    }
+    if blocks[0].get("scale") is not None:
+        stacked["scale"] = np.concatenate([b["scale"] for b in blocks])
+    return stacked
+
+def compact_matrices(matrices):
+    # groups in VECTOR_STORAGE (vector_storage.py); no copy when they already are
+    compact = dict(matrices)
+    for group in SIMILARITY_GROUPS:
+        compact[group] = compact_block(matrices[group])
+    return compact
+
+def encode_student(student, encoders, lookup=None):
     model = encoders["model"]
     
     # 3. 1 high dimensional vector per student
-    # Semantic embeddings
-    major_embedding = normalize_vec(model.encode(student["major"]))
-    minor_embedding = normalize_vec(model.encode(student["minor"]))
+    # Semantic embeddings (lookup = text embeddings batched by encode_all_students)
+    major_embedding = normalize_vec(embed_one(model, student["major"], lookup))
+    minor_embedding = normalize_vec(embed_one(model, student["minor"], lookup))
 
-    club_embedding = normalize_vec(embed_avg(model, student["clubs"]))
-    internship_embedding = normalize_vec(embed_avg(model, student["internships"]))
+    club_embedding = normalize_vec(embed_avg(model, student["clubs"], lookup))
+    internship_embedding = normalize_vec(embed_avg(model, student["internships"], lookup))
 
-    hometown_vec = encoders["hometown"].transform([[student["hometown"]]]).flatten()
-    hometown_vec = normalize_vec(hometown_vec)
-    dorm_vec = encoders["dorm"].transform([[student["dorm"]]]).flatten()
-    dorm_vec = normalize_vec(dorm_vec)
+    # One-hot / multi-label blocks stay CSR (1 x vocab)
+    hometown_vec = _normalize_rows(encoders["hometown"].transform([[student["hometown"]]]))
+    dorm_vec = _normalize_rows(encoders["dorm"].transform([[student["dorm"]]]))
 
     # For rarity weighting, multiply encoded vector by particular feature idf (calculated at encoding)
-    clubs_vec = encoders["clubs"].transform([student["clubs"]]).flatten()
-    clubs_vec = clubs_vec * encoders["club_idf"]
-    clubs_vec = normalize_vec(clubs_vec)
+    clubs_vec = encoders["clubs"].transform([student["clubs"]])
+    clubs_vec = _normalize_rows(_scale_columns(clubs_vec, encoders["club_idf"]))
 
-    courses_vec = encoders["courses"].transform([student["courses"]]).flatten()
-    courses_vec = courses_vec * encoders["course_idf"]
-    courses_vec = normalize_vec(courses_vec)
+    courses_vec = encoders["courses"].transform([student["courses"]])
+    courses_vec = _normalize_rows(_scale_columns(courses_vec, encoders["course_idf"]))
 
-    internships_vec = encoders["internships"].transform([student["internships"]]).flatten()
-    internships_vec = internships_vec * encoders["internship_idf"]
-    internships_vec = normalize_vec(internships_vec)
+    internships_vec = encoders["internships"].transform([student["internships"]])
+    internships_vec = _normalize_rows(_scale_columns(internships_vec, encoders["internship_idf"]))
 
-    return {
-        "academics": np.hstack([major_embedding, minor_embedding, courses_vec]),
-        "professional": np.hstack([clubs_vec, internships_vec, club_embedding, internship_embedding]),
-        "background": np.hstack([hometown_vec, dorm_vec]),
+    return reduce_blocks({
+        "academics": _block([major_embedding, minor_embedding], [courses_vec]),
+        "professional": _block([club_embedding, internship_embedding], [clubs_vec, internships_vec]),
+        "background": _block([], [hometown_vec, dorm_vec]),
         # "semantic": np.hstack([club_embedding, internship_embedding]),
-    }
+    }, encoders)
+
+def _text_lookup(students, encoders, batch_size):
+    texts = []
+    for student in students:
+        texts.append(student["major"])
+        texts.append(student["minor"])
+        texts.extend(student["clubs"])
+        texts.extend(student["internships"])
+    return embed_texts(encoders["model"], texts, batch_size=batch_size)
+
+def encode_all_students(students, encoders, batch_size=EMBED_BATCH_SIZE):
+    # encode every distinct major/minor/club/company once, in large batches,
+    # then assemble each student's vectors by lookup
+    lookup = _text_lookup(students, encoders, batch_size)
 
-def encode_all_students(students, encoders):
     student_vectors = {}
 
     for student in students:
-        student_vectors[student["NDID"]] = encode_student(student, encoders)
+        student_vectors[student["NDID"]] = encode_student(student, encoders, lookup)
 
     return student_vectors
 
+def encode_cohort(students, encoders, batch_size=EMBED_BATCH_SIZE):
+    # whole-cohort version of encode_student: one transform per encoder over all
+    # students (CSR), dense embeddings filled row by row from the batched lookup
+    model = encoders["model"]
+    lookup = _text_lookup(students, encoders, batch_size)
+    dim = model.get_sentence_embedding_dimension()
+
+    ndids = []
+    semantic = {k: [] for k in ("major", "minor", "clubs", "internships")}
+    for student in students:
+        ndids.append(student["NDID"])
+        semantic["major"].append(normalize_vec(embed_one(model, student["major"], lookup)))
+        semantic["minor"].append(normalize_vec(embed_one(model, student["minor"], lookup)))
+        semantic["clubs"].append(normalize_vec(embed_avg(model, student["clubs"], lookup)))
+        semantic["internships"].append(normalize_vec(embed_avg(model, student["internships"], lookup)))
+
+    N = len(ndids)
+    dense = {k: np.array(v).reshape(N, dim) for k, v in semantic.items()}
+
+    labels = _label_blocks(students, encoders)
+
+    blocks = reduce_blocks({
+        "academics": _block([dense["major"], dense["minor"]], [labels["academics"]], N),
+        "professional": _block([dense["clubs"], dense["internships"]], [labels["professional"]], N),
+        "background": _block([], [labels["background"]], N),
+    }, encoders)
+
+    matrices = {"ndids": ndids, "rows": {ndid: i for i, ndid in enumerate(ndids)}}
+    for group in SIMILARITY_GROUPS:
+        matrices[group] = normalize_block(blocks[group])
+    return matrices
+
+# -- Parallel cold rebuild --
+# fitted encoders (+ model) of a rebuild worker process, set once by the pool initializer
+_SHARD_JOB = {}
+
+def _pin_torch_threads(n):
+    # one pool of n intra-op threads per worker, so processes x threads <= cores
+    try:
+        import torch
+    except ImportError:
+        return
+    torch.set_num_threads(n)
+    try:
+        torch.set_num_interop_threads(1)
+    except RuntimeError:
+        pass  # only settable before the first parallel op
+
+def _init_shard_worker(encoders, threads):
+    _pin_torch_threads(threads)
+    _SHARD_JOB["encoders"] = _with_model(encoders)
+
+def _encode_shard(index, students, batch_size):
+    t0 = time.perf_counter()
+    matrices = encode_cohort(students, _SHARD_JOB["encoders"], batch_size)
+    return index, matrices, {
+        "shard": index,
+        "students": len(students),
+        "seconds": time.perf_counter() - t0,
+        "pid": os.getpid(),
+    }
+
+def merge_shards(parts):
+    # row-wise concatenation of shard matrices (same encoders -> same columns)
+    ndids = [ndid for part in parts for ndid in part["ndids"]]
+    merged = {"ndids": ndids, "rows": {ndid: i for i, ndid in enumerate(ndids)}}
+    for group in SIMILARITY_GROUPS:
+        merged[group] = stack_blocks([part[group] for part in parts])
+    return merged
+
+def encode_cohort_parallel(students, encoders, processes=REBUILD_PROCESSES, batch_size=EMBED_BATCH_SIZE):
+    # -> (matrices, report); encode_cohort over contiguous shards in a process pool
+    processes = max(1, min(processes, len(students) // max(1, REBUILD_MIN_SHARD)))
+    t0 = time.perf_counter()
+    if processes == 1:
+        matrices = encode_cohort(students, encoders, batch_size)
+        seconds = time.perf_counter() - t0
+        return matrices, {"processes": 1, "seconds": seconds,
+                          "shards": [{"shard": 0, "students": len(students), "seconds": seconds, "pid": os.getpid()}]}
+
+    threads = REBUILD_TORCH_THREADS or max(1, (os.cpu_count() or 1) // processes)
+    size = math.ceil(len(students) / processes)
+    rows = iter(students)
+    shards = [shard for shard in (list(itertools.islice(rows, size)) for _ in range(processes)) if shard]
+    # sent once per worker; the model is loaded in the worker, not pickled
+    state = {k: v for k, v in encoders.items() if k not in ("model", "labels")}
+
+    # spawn, not fork: a fork of a process whose torch thread pool already ran can deadlock.
+    # Each shard re-imports the parent's main script as __mp_main__ (with `python app.py`
+    # that builds the Flask app and an idle RebuildWorker; the model warm-up is skipped)
+    ctx = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=len(shards), mp_context=ctx,
+                             initializer=_init_shard_worker, initargs=(state, threads)) as pool:
+        futures = [pool.submit(_encode_shard, i, shard, batch_size) for i, shard in enumerate(shards)]
+        results = sorted((f.result() for f in futures), key=lambda r: r[0])
+
+    matrices = merge_shards([m for _, m, _ in results])
+    seconds = time.perf_counter() - t0
+    report = {
+        "processes": len(shards),
+        "torch_threads": threads,
+        "seconds": seconds,
+        "shards": [r for _, _, r in results],
+    }
+    for r in report["shards"]:
+        print(f"[alg] shard {r['shard']}: {r['students']} students in {r['seconds']:.2f}s (pid {r['pid']})")
+    busy = sum(r["seconds"] for r in report["shards"])
+    report["speedup"] = busy / seconds if seconds > 0 else 0.0
+    print(f"[alg] Encoded {len(students)} students on {len(shards)} processes in {seconds:.2f}s "
+          f"(speedup {report['speedup']:.1f}x = summed shard time / wall time)")
+    return matrices, report
+
+def reduce_matrices(matrices, encoders):
+    # reduced + renormalized copy of full-width matrices (projection is linear,
+    # so this matches encoding with the reducers from the start)
+    blocks = reduce_blocks({g: matrices[g] for g in SIMILARITY_GROUPS}, encoders)
+    reduced = {"ndids": matrices["ndids"], "rows": matrices["rows"]}
+    for group in SIMILARITY_GROUPS:
+        reduced[group] = normalize_block(blocks[group])
+    return reduced
+
+def overlap_at_k(reference, candidate, k=10, n_queries=200, weights=None, seed=0):
+    # mean share of each sampled user's top k under `reference` that `candidate` also ranks top k
+    weights = weights or DEFAULT_ALG_WEIGHTS
+    ndids = reference["ndids"]
+    if len(ndids) < 2:
+        return 1.0
+    rng = np.random.default_rng(seed)
+    users = rng.choice(len(ndids), size=min(n_queries, len(ndids)), replace=False)
+    k = min(k, len(ndids) - 1)
+    total = 0.0
+    for row in users:
+        tops = []
+        for matrices in (reference, candidate):
+            scores = score_against_all(ndids[row], matrices, weights)
+            scores[row] = -np.inf
+            tops.append(set(top_indices(scores, k).tolist()))
+        total += len(tops[0] & tops[1]) / k
+    return total / len(users)
+
+def _flatten_block(v):
+    # encode_student groups are {"dense", "sparse"} blocks
+    if isinstance(v, dict):
+        return np.hstack([v["dense"].ravel(), v["sparse"].toarray().ravel()])
+    return v
+
 def compute_cosine(a, b):
+    a, b = _flatten_block(a), _flatten_block(b)
     if np.linalg.norm(a) == 0 or np.linalg.norm(b) == 0:
         return 0.0
     return float(np.dot(a, b) / (np.linalg.norm(a) * np.linalg.norm(b)))
@@ -323,35 +1121,887 @@ def weighted_similarity(vectors1, vectors2, weights):
 
     return score / denom if denom > 0 else 0.0  # handle default case
     
-def return_similarities_weighted(user_id, engine, weights, n=None):
-    students = load_students(engine)
-    encoders = fit_encoders(students)
+# -- Vectorized similarity engine --
+# groups that get stacked into one matrix each (same keys encode_student returns)
+SIMILARITY_GROUPS = ("academics", "professional", "background")
+
+def build_similarity_matrices(encoded_students):
+    # stack each group into unit-length rows (dense part + CSR part), so cosine
+    # against everyone is one dense and one sparse matrix-vector product
+    ndids = list(encoded_students.keys())
+    matrices = {
+        "ndids": ndids,
+        "rows": {ndid: i for i, ndid in enumerate(ndids)},
+    }
 
-    encoded_students = encode_all_students(students, encoders)
+    for group in SIMILARITY_GROUPS:
+        block = stack_blocks([encoded_students[ndid][group] for ndid in ndids])
+        matrices[group] = normalize_block(block) if ndids else block
+
+    return matrices
+
+def group_score_vectors(user_id, matrices, rows=None):
+    # (len(SIMILARITY_GROUPS), N) raw cosines of one user against every row, per group
+    # (or against just `rows`)
+    row = matrices["rows"][user_id]
+    n = len(matrices["ndids"]) if rows is None else len(rows)
+    out = np.empty((len(SIMILARITY_GROUPS), n))
+    for i, key in enumerate(SIMILARITY_GROUPS):
+        block = matrices[key]
+        S = block["sparse"]
+        user_sparse = S[row].toarray().ravel()
+        out[i] = dense_dot(block, dense_rows(block, row), rows) + (S if rows is None else S[rows]) @ user_sparse
+    return out
+
+def combine_group_scores(group_scores, weights):
+    # weighted_similarity from the per-group vectors in one matrix-vector product
+    w = np.array([max(float(weights.get(key, 0)), 0.0) for key in SIMILARITY_GROUPS])
+    denom = w.sum()
+    scores = w @ group_scores
+    return scores / denom if denom > 0 else scores
+
+def score_against_all(user_id, matrices, weights):
+    # weighted_similarity for one user against every row at once
+    return combine_group_scores(group_score_vectors(user_id, matrices), weights)
+
+# per-user group score vectors (24 bytes per student each), so moving the
+# sliders only recombines them; entries are tied to the matrices' generation
+GROUP_SCORE_CACHE_SIZE = int(os.environ.get("GROUP_SCORE_CACHE_SIZE", "128"))
+_GROUP_SCORES = OrderedDict()
+_GROUP_SCORES_LOCK = threading.Lock()
+_GENERATIONS = itertools.count(1)
+
+def cached_group_scores(user_id, matrices):
+    key = (user_id, matrices.get("generation"))
+    with _GROUP_SCORES_LOCK:
+        hit = _GROUP_SCORES.get(key)
+        if hit is not None:
+            _GROUP_SCORES.move_to_end(key)
+            return hit
+
+    scores = group_score_vectors(user_id, matrices)
+    if key[1] is None or GROUP_SCORE_CACHE_SIZE <= 0:
+        return scores
+    with _GROUP_SCORES_LOCK:
+        _GROUP_SCORES[key] = scores
+        while len(_GROUP_SCORES) > GROUP_SCORE_CACHE_SIZE:
+            _GROUP_SCORES.popitem(last=False)
+    return scores
+
+def top_indices(scores, k):
+    # indices of the k best scores, best first, via argpartition (O(N + k log k)).
+    # ties resolve to the lower index, exactly like a full stable sort
+    n = len(scores)
+    if k >= n:
+        return np.argsort(-scores, kind="stable")
+    if k <= 0:
+        return np.zeros(0, dtype=np.intp)
+    part = np.argpartition(-scores, k - 1)[:k]
+    threshold = scores[part].min()
+    above = np.flatnonzero(scores > threshold)
+    ties = np.flatnonzero(scores == threshold)[:k - len(above)]
+    idx = np.concatenate([above, ties])
+    return idx[np.argsort(-scores[idx], kind="stable")]
+
+class LazyRanking:
+    """
+    One user's ranking that is only sorted as far as someone has asked for.
+    page(offset, limit) returns ranks [offset, offset + limit); the sorted prefix
+    grows (at least doubling) with top_indices instead of sorting the cohort.
+    """
 
-    if user_id not in encoded_students:
-        raise ValueError("User not found")
-    
-    user_vectors = encoded_students[user_id]
-    
-    results = []
-    for ndid, vectors in encoded_students.items():
-        if ndid == user_id:
+    def __init__(self, ndids, rows, scores, exclude_row=None):
+        self.ndids = ndids
+        self.rows = rows
+        self.scores = np.array(scores, dtype=np.float64)
+        self.total = len(ndids)
+        if exclude_row is not None:
+            self.scores[exclude_row] = -np.inf
+            self.total -= 1
+        self._order = np.zeros(0, dtype=np.intp)
+
+    def __len__(self):
+        return self.total
+
+    def _ensure(self, k):
+        k = min(k, self.total)
+        if k <= len(self._order):
+            return
+        k = min(max(k, 2 * len(self._order)), self.total)
+        self._order = top_indices(self.scores, k)
+
+    def page(self, offset, limit):
+        offset = max(0, offset)
+        self._ensure(offset + max(0, limit))
+        idx = self._order[offset:offset + max(0, limit)]
+        return [(self.ndids[i], float(self.scores[i])) for i in idx]
+
+    def top(self, n):
+        return self.page(0, n)
+
+    def all(self):
+        return self.page(0, self.total)
+
+    def score_of(self, ndid, default=0.0):
+        row = self.rows.get(ndid)
+        return default if row is None else float(self.scores[row])
+
+def rank_scores(user_id, matrices, scores, n=None):
+    ranking = LazyRanking(matrices["ndids"], matrices["rows"], scores, exclude_row=matrices["rows"][user_id])
+    return ranking.all() if not n else ranking.top(n)
+
+# -- Incremental updates --
+# fitted encoders + stacked matrices kept between requests, so a signup or
+# profile edit only has to encode that one student
+_STATE = {"encoders": None, "matrices": None, "ann": None, "snapshot_version": None}
+_STATE_LOCK = threading.Lock()
+_SNAPSHOTS = None
+# poll -> unpickle -> install is one step per process, and writers hold it for their
+# whole update: nobody builds on state another thread is halfway through replacing
+_SYNC_LOCK = threading.RLock()
+
+def _segment_widths(encoders):
+    # column layout of the stored / scored blocks: reduced groups carry their
+    # projected label columns as one trailing dense segment and no sparse part
+    widths = _raw_segment_widths(encoders)
+    for group, reducer in (encoders.get("reducers") or {}).items():
+        widths[group] = {
+            "dense": widths[group]["dense"] + [("reduced_labels", reducer["components"].shape[1])],
+            "sparse": [],
+        }
+    return widths
+
+def _raw_segment_widths(encoders):
+    # column layout of each group's dense and sparse parts, in hstack order
+    dim = encoders["model"].get_sentence_embedding_dimension()
+    return {
+        "academics": {
+            "dense": [("major", dim), ("minor", dim)],
+            "sparse": [("courses", len(encoders["courses"].classes_))],
+        },
+        "professional": {
+            "dense": [("club_embedding", dim), ("internship_embedding", dim)],
+            "sparse": [
+                ("clubs", len(encoders["clubs"].classes_)),
+                ("internships", len(encoders["internships"].classes_)),
+            ],
+        },
+        "background": {
+            "dense": [],
+            "sparse": [
+                ("hometown", len(encoders["hometown"].categories_[0])),
+                ("dorm", len(encoders["dorm"].categories_[0])),
+            ],
+        },
+    }
+
+def extend_encoders(encoders, student):
+    # returns (new encoders, {segment: n appended}); unseen values become new
+    # trailing dimensions of their segment so existing columns keep their meaning
+    from sklearn.preprocessing import OneHotEncoder, MultiLabelBinarizer
+
+    updated = dict(encoders)
+    added = {}
+
+    for key in ("hometown", "dorm"):
+        known = list(encoders[key].categories_[0])
+        value = student[key]
+        if value in known:
             continue
-        score = weighted_similarity(user_vectors, vectors, weights)
-        results.append((ndid, score))
-    
-    results.sort(key=lambda x: x[1], reverse=True)
-    return results if not n else results[:n]
+        enc = OneHotEncoder(categories=[known + [value]], handle_unknown="ignore", sparse_output=True)
+        enc.fit([[value]])
+        updated[key] = enc
+        added[key] = 1
+
+    # new labels get the idf of a label seen once in the fitted cohort
+    new_idf = np.log(encoders["n_students"] / 2) if encoders["n_students"] > 0 else 0.0
+    for key, idf_key in (("courses", "course_idf"), ("clubs", "club_idf"), ("internships", "internship_idf")):
+        known = list(encoders[key].classes_)
+        known_set = set(known)
+        new_labels = []
+        for label in student[key]:
+            if label not in known_set and label not in new_labels:
+                new_labels.append(label)
+        if not new_labels:
+            continue
+        mlb = MultiLabelBinarizer(classes=known + new_labels, sparse_output=True)
+        mlb.fit([])
+        updated[key] = mlb
+        updated[idf_key] = np.concatenate([encoders[idf_key], np.full(len(new_labels), new_idf)])
+        count_key = idf_key.replace("_idf", "_counts")
+        if count_key in encoders:
+            updated[count_key] = np.concatenate([encoders[count_key], np.zeros(len(new_labels), dtype=np.int64)])
+        added[key] = len(new_labels)
+
+    if added:
+        updated["extensions"] = encoders["extensions"] + 1
+        updated["version"] = f"{encoders['fit_id']}.{updated['extensions']}"
+
+    return updated, added
+
+def _pad_sparse(S, old_segments, new_segments):
+    # segments only ever grow at their end -> shift column indices of later
+    # segments right by however much the earlier ones grew
+    old_w = [w for _, w in old_segments]
+    new_w = [w for _, w in new_segments]
+    if old_w == new_w:
+        return S
+    grown = np.cumsum([0] + [n - o for o, n in zip(old_w, new_w)])[:-1]
+    shift = np.repeat(grown, old_w).astype(S.indices.dtype)
+    return sparse.csr_matrix(
+        (S.data, S.indices + shift[S.indices], S.indptr),
+        shape=(S.shape[0], sum(new_w)),
+    )
+
+def _pad_matrices(matrices, old_widths, new_widths):
+    padded = dict(matrices)
+    for group in SIMILARITY_GROUPS:
+        block = matrices[group]
+        padded[group] = dict(
+            block, sparse=_pad_sparse(block["sparse"], old_widths[group]["sparse"], new_widths[group]["sparse"])
+        )
+    return padded
+
+def _upsert_row(matrices, ndid, vectors):
+    updated = dict(matrices)
+    row = matrices["rows"].get(ndid)
+
+    if row is None:
+        updated["ndids"] = matrices["ndids"] + [ndid]
+        updated["rows"] = dict(matrices["rows"])
+        updated["rows"][ndid] = len(matrices["ndids"])
+
+    for group in SIMILARITY_GROUPS:
+        block = matrices[group]
+        v = compact_block(normalize_block(vectors[group]))
+        if row is None:
+            updated[group] = stack_blocks([block, v])
+            continue
+        S = block["sparse"]
+        D = block["dense"].copy()  # copy-on-write: readers may hold the old matrix
+        D[row] = v["dense"][0]
+        updated[group] = {"dense": D, "sparse": sparse.vstack([S[:row], v["sparse"], S[row + 1:]], format="csr")}
+        if block.get("scale") is not None:
+            updated[group]["scale"] = block["scale"].copy()
+            updated[group]["scale"][row] = v["scale"][0]
+
+    return updated
+
+def _snapshot_store():
+    global _SNAPSHOTS
+    if _SNAPSHOTS is None and SNAPSHOT_DIR:
+        try:
+            _SNAPSHOTS = SnapshotStore(SNAPSHOT_DIR)
+        except OSError as e:
+            print(f"[alg] Shared snapshots disabled: {e}")
+    return _SNAPSHOTS
+
+@contextmanager
+def _snapshot_lock():
+    # serializes snapshot writers across worker processes, and against syncs in this one
+    store = _snapshot_store()
+    if store is None:
+        yield
+        return
+    with store.lock(), _SYNC_LOCK:
+        yield
+
+def _with_model(encoders):
+    # encoders mapped from a snapshot come without the model; load it only to encode
+    if "model" in encoders:
+        return encoders
+    return dict(encoders, model=get_model(MODEL_NAME))
+
+def _set_state(encoders, matrices, snapshot_version=None, keep_index=False):
+    # keep_index: carry the IVF index over when the new state only differs by edits
+    matrices["generation"] = next(_GENERATIONS)
+    matrices["snapshot_version"] = snapshot_version
+    with _STATE_LOCK:
+        index = None
+        if keep_index:
+            index = _follow_index(_STATE["ann"], _STATE["encoders"], _STATE["matrices"], encoders, matrices)
+        _STATE["encoders"] = encoders
+        _STATE["matrices"] = matrices
+        _STATE["ann"] = index
+        _STATE["snapshot_version"] = snapshot_version
+
+def sync_snapshot():
+    # swap to the newest published snapshot (zero-copy) if one appeared since last check
+    store = _snapshot_store()
+    if store is None:
+        return False
+    # another thread is syncing or writing and installs the result itself; requests
+    # keep serving the current state instead of queueing behind it
+    if not _SYNC_LOCK.acquire(blocking=False):
+        return False
+    try:
+        try:
+            snap = store.poll()
+        except Exception as e:
+            print(f"[alg] Could not map snapshot: {e}")
+            return False
+        if snap is None:
+            return False
+
+        header, matrices, payload = snap
+        if header["meta"].get("layout_format") != LAYOUT_FORMAT:
+            return False
+        # always take the payload: label counts change without a version bump
+        try:
+            encoders = pickle.loads(payload)
+        except Exception as e:
+            print(f"[alg] Could not load snapshot {header['version']}: {e}")
+            store.forget()
+            return False
+        if _STATE["encoders"] is not None and "model" in _STATE["encoders"]:
+            encoders["model"] = _STATE["encoders"]["model"]
+        _set_state(encoders, compact_matrices(matrices), snapshot_version=header["version"], keep_index=True)
+        return True
+    finally:
+        _SYNC_LOCK.release()
+
+def _publish_snapshot(encoders, matrices):
+    # caller holds _snapshot_lock(); other workers pick this up on their next sync
+    store = _snapshot_store()
+    if store is None:
+        return
+    version = f"{encoders['version']}-{uuid.uuid4().hex[:8]}"
+    state = {k: v for k, v in encoders.items() if k != "model"}
+    try:
+        store.publish(
+            version, matrices, SIMILARITY_GROUPS,
+            payload=pickle.dumps(state, protocol=pickle.HIGHEST_PROTOCOL),
+            meta={"encoder_version": encoders["version"], "layout_format": LAYOUT_FORMAT},
+        )
+    except Exception as e:
+        print(f"[alg] Could not publish snapshot: {e}")
+        return
+    # map our own file too, so this process drops its private copy (same rows, so
+    # the sync keeps an ANN index that was kept up to date incrementally)
+    encoders = _STATE["encoders"]
+    if sync_snapshot():
+        _STATE["encoders"] = encoders
+
+def _recount_labels(encoders, students, rows):
+    # label index + counts from scratch for the embedded students (one pass, O(labels))
+    encoders = dict(encoders)
+    for key, _, count_key in IDF_LABELS:
+        encoders[count_key] = np.zeros(len(encoders[key].classes_), dtype=np.int64)
+    encoders["labels"] = {}
+    encoders["n_students"] = 0
+    for student in students:
+        if student["NDID"] in rows:
+            labels = _student_labels(student)
+            encoders["labels"][student["NDID"]] = labels
+            encoders["n_students"] += 1
+            # unseen labels (added after these encoders were saved) are ignored by transform
+            _count_labels(encoders, labels, +1)
+    return encoders
+
+def _unit_segments(D, segments):
+    # undo the block normalization of the dense part: every raw segment was unit length (or zero)
+    parts = []
+    start = 0
+    for _, width in segments:
+        part = D[:, start:start + width]
+        norms = np.linalg.norm(part, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        parts.append(part / norms)
+        start += width
+    return np.hstack(parts) if parts else np.zeros((D.shape[0], 0))
+
+def refresh_label_weights(engine=None):
+    # lazy re-normalization: bake the idf implied by the running counts into every
+    # row's label columns (O(nnz), no re-encoding); dense embeddings are kept
+    with _snapshot_lock():
+        sync_snapshot()
+        with _STATE_LOCK:
+            encoders, matrices = _STATE["encoders"], _STATE["matrices"]
+            if matrices is None or "labels" not in encoders:
+                return False
+            encoders = dict(_with_model(encoders), **current_idf(encoders))
+
+            empty = ((),) * len(IDF_LABELS)
+            students = []
+            for ndid in matrices["ndids"]:
+                courses, clubs, internships = encoders["labels"].get(ndid, empty)
+                students.append({"hometown": "", "dorm": "", "courses": list(courses),
+                                 "clubs": list(clubs), "internships": list(internships)})
+            labels = _label_blocks(students, encoders)
+
+            raw = _raw_segment_widths(encoders)
+            blocks = {g: matrices[g] for g in SIMILARITY_GROUPS}
+            for group in ("academics", "professional"):
+                dense_w = sum(w for _, w in raw[group]["dense"])
+                D = _unit_segments(dense_rows(matrices[group])[:, :dense_w], raw[group]["dense"])
+                blocks[group] = {"dense": D, "sparse": labels[group]}
+            blocks = reduce_blocks({g: blocks[g] for g in ("academics", "professional")}, encoders)
+
+            updated = dict(matrices)
+            for group in ("academics", "professional"):
+                updated[group] = compact_block(normalize_block(blocks[group]))
+            updated["generation"] = next(_GENERATIONS)
+            updated["snapshot_version"] = None
+            # every row's label columns moved: neighbours computed before are stale
+            encoders = _touch(encoders)
+            encoders["label_refresh"] = encoders["edits"]
+            # same rows, label columns re-weighted by a few percent: lists stay usable
+            _STATE["ann"] = _follow_index(_STATE["ann"], _STATE["encoders"], matrices, encoders, updated)
+            _STATE["encoders"] = encoders
+            _STATE["matrices"] = updated
+        _publish_snapshot(encoders, updated)
+
+    print(f"[alg] Refreshed label idf weights for {len(updated['ndids'])} students")
+    if engine is not None:
+        _persist(engine, encoders, updated)
+    return True
 
 def rebuild_on_new_user(engine):
-    students = load_students(engine)
+    # full rebuild: reload cohort, refit encoders, re-encode everyone
+    students = load_student_table(engine)
     encoders = fit_encoders(students)
-    encoded_students = encode_all_students(students, encoders)
 
     print("Rebuilding embeddings for", len(students), "students")
 
-    return encoded_students
+    if encoders["reducers"]:
+        # encode at full width once to report how much ranking the reduction keeps
+        full, report = encode_cohort_parallel(students, dict(encoders, reducers={}))
+        matrices = reduce_matrices(full, encoders)
+        encoders["reduction_report"] = {
+            "method": REDUCE_METHOD,
+            "widths": {
+                g: [full[g]["dense"].shape[1] + full[g]["sparse"].shape[1],
+                    matrices[g]["dense"].shape[1] + matrices[g]["sparse"].shape[1]]
+                for g in SIMILARITY_GROUPS
+            },
+            "overlap@10": overlap_at_k(full, matrices, k=10),
+        }
+        print(f"[alg] Reduced label columns: {encoders['reduction_report']}")
+    else:
+        matrices, report = encode_cohort_parallel(students, encoders)
+    encoders["rebuild_report"] = report
+    matrices = compact_matrices(matrices)
+    with _snapshot_lock():
+        _set_state(encoders, matrices)
+        _publish_snapshot(encoders, matrices)
+
+    _persist(engine, encoders, matrices)
+
+    return matrices
+
+def _ensure_tables(engine):
+    if not _STATE.get("tables_ready"):
+        ensure_embeddings_table(engine)
+        _STATE["tables_ready"] = True
+
+def _persist(engine, encoders, matrices, ndids=None, save_encoders=True):
+    # best effort: the in-memory state is already usable if MySQL write fails
+    try:
+        _ensure_tables(engine)
+        if save_encoders:
+            save_encoders_to_db(encoders, engine)
+        save_embeddings_to_db(matrices, encoders, engine, ndids=ndids)
+        if ndids is None:
+            prune_encoders_in_db(encoders, engine)
+    except Exception as e:
+        print(f"[alg] Could not persist embeddings: {e}")
+
+def _reconcile(encoders, matrices, students):
+    # stored rows vs the Students table: drop rows of deleted students, encode students
+    # with no usable row (persist lost, or written by another fit).
+    # -> (encoders, matrices, encoded ndids, dropped ndids), or None when a full rebuild is cheaper
+    known = set(students.ndids)
+    dropped = [ndid for ndid in matrices["ndids"] if ndid not in known]
+    if dropped:
+        keep = np.array([ndid in known for ndid in matrices["ndids"]], dtype=bool)
+        ndids = [ndid for ndid in matrices["ndids"] if ndid in known]
+        reconciled = {"ndids": ndids, "rows": {ndid: i for i, ndid in enumerate(ndids)}}
+        for group in SIMILARITY_GROUPS:
+            reconciled[group] = take_rows(matrices[group], keep)
+        matrices = reconciled
+
+    missing = [student for student in students if student["NDID"] not in matrices["rows"]]
+    if len(missing) * 2 > len(students):
+        return None
+    if missing:
+        old_widths = _segment_widths(encoders)
+        for student in missing:
+            encoders, _ = extend_encoders(encoders, student)
+        new_widths = _segment_widths(encoders)
+        if new_widths != old_widths:
+            matrices = _pad_matrices(matrices, old_widths, new_widths)
+        encoded = compact_matrices(encode_cohort(missing, encoders))
+        ndids = matrices["ndids"] + encoded["ndids"]
+        matrices = dict(matrices, ndids=ndids, rows={ndid: i for i, ndid in enumerate(ndids)})
+        for group in SIMILARITY_GROUPS:
+            matrices[group] = stack_blocks([matrices[group], encoded[group]])
+    return encoders, matrices, [s["NDID"] for s in missing], dropped
+
+def load_state_from_db(engine):
+    # start from stored vectors instead of re-encoding the cohort, reconciled with Students
+    try:
+        _ensure_tables(engine)
+        encoders = load_encoders_from_db(engine)
+        if encoders is None or encoders.get("layout_format") != LAYOUT_FORMAT:
+            return False
+        matrices = compact_matrices(load_student_embeddings(engine, encoders))
+        students = load_student_table(engine)
+        reconciled = _reconcile(encoders, matrices, students)
+        if reconciled is None:
+            return False
+        version = encoders["version"]
+        encoders, matrices, encoded, dropped = reconciled
+        encoders = _recount_labels(encoders, students, matrices["rows"])
+        # what changed since these encoders were saved is unknown -> new edit history
+        encoders.update(_new_edit_log())
+    except Exception as e:
+        print(f"[alg] Could not load stored embeddings: {e}")
+        return False
+
+    if not matrices["ndids"]:
+        return False
+
+    if encoded or dropped:
+        print(f"[alg] Reconciled stored embeddings: encoded {len(encoded)}, dropped {len(dropped)}")
+        for ndid in dropped:
+            try:
+                delete_embedding_from_db(ndid, engine)
+            except Exception as e:
+                print(f"[alg] Could not delete stored embedding for {ndid}: {e}")
+        if encoded:
+            _persist(engine, encoders, matrices, ndids=encoded, save_encoders=encoders["version"] != version)
+
+    with _snapshot_lock():
+        if not sync_snapshot():
+            _set_state(encoders, matrices)
+            _publish_snapshot(encoders, matrices)
+    return True
+
+# concurrent identical loads / score computations share one run (see singleflight.py)
+RECOMMEND_FLIGHTS = SingleFlight()
+
+def _load_or_rebuild(engine):
+    if _STATE["matrices"] is None and not load_state_from_db(engine):
+        rebuild_on_new_user(engine)
+
+def get_similarity_state(engine):
+    sync_snapshot()  # one stat() when nothing changed
+    encoders, matrices = _STATE["encoders"], _STATE["matrices"]
+    if matrices is None:
+        RECOMMEND_FLIGHTS.do(("state",), lambda: _load_or_rebuild(engine))
+        encoders, matrices = _STATE["encoders"], _STATE["matrices"]
+    return encoders, matrices
+
+def update_student_embedding(ndid, engine):
+    # incremental path for register/edit_profile: encode only this student
+    sync_snapshot()
+    if _STATE["matrices"] is None or not _STATE["matrices"]["ndids"]:
+        rebuild_on_new_user(engine)
+        return
+
+    students = load_students(engine, ndid=ndid)
+    if not students:
+        remove_student_embedding(ndid, engine)
+        return
+    student = students[0]
+
+    with _snapshot_lock():
+        sync_snapshot()  # apply on top of whatever another worker published last
+        with _STATE_LOCK:
+            encoders, matrices, added = _apply_student(ndid, student)
+        _publish_snapshot(encoders, matrices)
+
+    _persist(engine, encoders, matrices, ndids=[ndid], save_encoders=bool(added))
+
+def _apply_student(ndid, student):
+    # caller holds _STATE_LOCK
+    encoders, matrices = _with_model(_STATE["encoders"]), _STATE["matrices"]
+    old_widths = _segment_widths(encoders)
+    encoders, added = extend_encoders(encoders, student)
+    encoders = _track_labels(encoders, ndid, _student_labels(student))
+    encoders = _touch(encoders, [ndid])
+    new_widths = _segment_widths(encoders)
+    if added:
+        matrices = _pad_matrices(matrices, old_widths, new_widths)
+
+    vectors = encode_student(student, encoders)
+    matrices = _upsert_row(matrices, ndid, vectors)
+
+    index = _STATE["ann"]
+    if index is not None:
+        index = copy.copy(index)  # readers may still be querying the old one
+        if added:
+            index.transform_sparse_centroids(
+                lambda g, C: _pad_sparse(C, old_widths[g]["sparse"], new_widths[g]["sparse"])
+            )
+        index.assign_rows(matrices, [matrices["rows"][ndid]])
+
+    matrices["generation"] = next(_GENERATIONS)
+    matrices["snapshot_version"] = None  # until it is published
+    if index is not None:
+        index.generation = matrices["generation"]
+    _STATE["encoders"] = encoders
+    _STATE["matrices"] = matrices
+    _STATE["ann"] = index
+    return encoders, matrices, added
+
+def remove_student_embedding(ndid, engine=None):
+    if engine is not None:
+        try:
+            delete_embedding_from_db(ndid, engine)
+        except Exception as e:
+            print(f"[alg] Could not delete stored embedding for {ndid}: {e}")
+
+    with _snapshot_lock():
+        sync_snapshot()
+        with _STATE_LOCK:
+            matrices = _STATE["matrices"]
+            if matrices is None or ndid not in matrices["rows"]:
+                return
+            row = matrices["rows"][ndid]
+            ndids = matrices["ndids"][:row] + matrices["ndids"][row + 1:]
+            updated = {
+                "ndids": ndids,
+                "rows": {n: i for i, n in enumerate(ndids)},
+                "generation": next(_GENERATIONS),
+                "snapshot_version": None,
+            }
+            keep = np.ones(len(matrices["ndids"]), dtype=bool)
+            keep[row] = False
+            for group in SIMILARITY_GROUPS:
+                updated[group] = take_rows(matrices[group], keep)
+            _STATE["matrices"] = updated
+            _STATE["encoders"] = _touch(_track_labels(_STATE["encoders"], ndid, None), [ndid])
+
+            if _STATE["ann"] is not None:
+                index = copy.copy(_STATE["ann"])
+                index.remove_row(row)
+                index.generation = updated["generation"]
+                _STATE["ann"] = index
+        _publish_snapshot(_STATE["encoders"], updated)
+
+def _matrices_with_user(user_id, engine):
+    encoders, matrices = get_similarity_state(engine)
+
+    if user_id not in matrices["rows"]:
+        # may have registered through another process -> try encoding just them
+        RECOMMEND_FLIGHTS.do(("student", user_id), lambda: update_student_embedding(user_id, engine))
+        encoders, matrices = get_similarity_state(engine)
+        if user_id not in matrices["rows"]:
+            raise ValueError("User not found")
+
+    return matrices
+
+def similarity_ranking(user_id, engine, weights):
+    # LazyRanking over everyone but the user; pages are sorted on demand
+    matrices = _matrices_with_user(user_id, engine)
+    scores = combine_group_scores(cached_group_scores(user_id, matrices), weights)
+    return LazyRanking(matrices["ndids"], matrices["rows"], scores, exclude_row=matrices["rows"][user_id])
+
+def similarity_version(matrices):
+    # identifies the data a score vector was computed from; published snapshots
+    # are shared by every worker, unpublished state only by this process
+    if matrices.get("snapshot_version"):
+        return matrices["snapshot_version"]
+    return f"local-{os.getpid()}-{matrices.get('generation')}"
+
+def weight_cache_key(weights):
+    return json.dumps({k: float(weights.get(k, 1.0)) for k in sorted(ALLOWED_WEIGHT_KEYS)}, sort_keys=True)
+
+def recommendation_view(user_id, engine, weights, cache):
+    # (LazyRanking, snapshot version, ndid -> {group: raw score}) for the JSON API
+    matrices = _matrices_with_user(user_id, engine)
+    ranking = _cached_ranking(user_id, matrices, weights, cache)
+    group_scores = cached_group_scores(user_id, matrices)
+    rows = matrices["rows"]
+
+    def groups_of(ndid):
+        row = rows[ndid]
+        return {key: float(group_scores[i, row]) for i, key in enumerate(SIMILARITY_GROUPS)}
+
+    return ranking, similarity_version(matrices), groups_of
+
+def _cached_ranking(user_id, matrices, weights, cache):
+    version = similarity_version(matrices)
+    key = weight_cache_key(weights)
+
+    scores = cache.get(user_id, key, version)
+    if scores is None or len(scores) != len(matrices["ndids"]):
+        # concurrent misses for the same (user, weights, version) share one computation
+        def compute():
+            fresh = combine_group_scores(cached_group_scores(user_id, matrices), weights)
+            cache.put(user_id, key, version, fresh)
+            return fresh
+        scores = RECOMMEND_FLIGHTS.do(("scores", user_id, key, version), compute)
+    return LazyRanking(matrices["ndids"], matrices["rows"], scores, exclude_row=matrices["rows"][user_id])
+
+def _follow_index(index, old_encoders, old_matrices, encoders, matrices):
+    # IVF index built for old_matrices, carried over to matrices when those only moved
+    # on by incremental edits (same fit and edit history): unchanged students keep their
+    # list, touched and new ones are assigned again, O(N + changed). None = rebuild
+    if index is None or old_matrices is None or index.generation != old_matrices.get("generation"):
+        return None
+    epoch = encoders.get("edit_epoch")
+    if epoch is None or epoch != old_encoders.get("edit_epoch") or encoders["fit_id"] != old_encoders["fit_id"]:
+        return None
+    since = old_encoders.get("edits", 0)
+    if encoders.get("edits", 0) < since:
+        return None
+
+    index = copy.copy(index)  # readers may still be querying the old one
+    old_widths, new_widths = _segment_widths(old_encoders), _segment_widths(encoders)
+    if old_widths != new_widths:
+        index.transform_sparse_centroids(
+            lambda g, C: _pad_sparse(C, old_widths[g]["sparse"], new_widths[g]["sparse"])
+        )
+    old_rows, rows = old_matrices["rows"], matrices["rows"]
+    previous = np.fromiter((old_rows.get(n, -1) for n in matrices["ndids"]), dtype=np.intp, count=len(rows))
+    index.take_rows(previous)
+    stale = previous < 0
+    for ndid in changed_since(encoders, since):
+        if ndid in rows:
+            stale[rows[ndid]] = True
+    index.assign_rows(matrices, np.flatnonzero(stale))
+    index.generation = matrices.get("generation")
+    return index
+
+_ANN_BUILDER = {"thread": None}
+
+def _build_ann_index(encoders, matrices):
+    # background thread: k-means over the whole cohort never runs on a request
+    t0 = time.perf_counter()
+    try:
+        index = IVFIndex(n_probe=ANN_N_PROBE).build(matrices)
+    except Exception as e:
+        print(f"[alg] Could not build ANN index: {e}")
+        return
+    index.generation = matrices.get("generation")
+    with _STATE_LOCK:
+        if _STATE["matrices"] is not matrices:
+            # edits landed while building: follow them instead of starting over
+            index = _follow_index(index, encoders, matrices, _STATE["encoders"], _STATE["matrices"])
+        if index is not None:
+            _STATE["ann"] = index
+    print(f"[alg] Built ANN index ({len(matrices['ndids'])} students) in {time.perf_counter() - t0:.2f}s")
+
+def get_ann_index(matrices):
+    # IVF index whose row assignments match `matrices`, or None (the caller scores
+    # exactly) while one is built in the background or `matrices` were replaced
+    index = _STATE["ann"]
+    if index is not None and index.generation == matrices.get("generation"):
+        return index
+    with _STATE_LOCK:
+        index = _STATE["ann"]
+        if index is not None and index.generation == matrices.get("generation"):
+            return index
+        builder = _ANN_BUILDER["thread"]
+        if _STATE["matrices"] is matrices and (builder is None or not builder.is_alive()):
+            builder = threading.Thread(
+                target=_build_ann_index, args=(_STATE["encoders"], matrices), name="ann-build", daemon=True
+            )
+            _ANN_BUILDER["thread"] = builder
+            builder.start()
+    return None
+
+def _is_default_weights(weights):
+    return all(float(weights.get(g, 0)) == float(w) for g, w in DEFAULT_ALG_WEIGHTS.items())
+
+def _encoders_of(matrices):
+    # encoders installed together with `matrices`, or None once they were replaced
+    with _STATE_LOCK:
+        return _STATE["encoders"] if _STATE["matrices"] is matrices else None
+
+def stored_neighbors(user_id, matrices, encoders, engine, k):
+    # default-weight top k [(ndid, score)] from the batch table (neighbors.py), or None.
+    # Rows stay usable while the edit history is the one the batch ran in: neighbours
+    # touched since are dropped and every student touched since is scored live, so
+    # one edit only costs that student's rows, not the whole table
+    if k > NEIGHBOR_K or encoders is None or "edit_epoch" not in encoders:
+        return None
+    stamp, stored = load_neighbors(user_id, engine)
+    epoch, _, edits = (stamp or "").rpartition(".")
+    if epoch != encoders["edit_epoch"] or not edits.isdigit():
+        return None
+    edits = int(edits)
+    if edits < encoders.get("label_refresh", 0) or edits > encoders.get("edits", 0):
+        return None
+    changed = changed_since(encoders, edits)
+    if user_id in changed:
+        return None
+    changed = set(changed)
+    rows = matrices["rows"]
+    kept = [(ndid, score) for ndid, score in stored if ndid not in changed and ndid in rows]
+    # untouched students past the stored list score no higher than its last entry
+    if len(kept) < k:
+        return None
+
+    live = np.array(sorted(rows[ndid] for ndid in changed if ndid in rows and ndid != user_id), dtype=np.intp)
+    if len(live):
+        scores = combine_group_scores(group_score_vectors(user_id, matrices, live), DEFAULT_ALG_WEIGHTS)
+        kept += [(matrices["ndids"][r], float(s)) for r, s in zip(live, scores)]
+    kept.sort(key=lambda item: -item[1])
+    return kept[:k]
+
+def _top_students(user_id, matrices, weights, k, engine=None, n_probe=None, approximate=True):
+    # top k [(ndid, score)] without scoring the cohort, or None: precomputed table
+    # for default weights, then (approximate only) the IVF index above ANN_MIN_STUDENTS
+    if engine is not None and _is_default_weights(weights):
+        try:
+            stored = stored_neighbors(user_id, matrices, _encoders_of(matrices), engine, k)
+        except Exception as e:
+            print(f"[alg] Could not read precomputed neighbours: {e}")
+            stored = None
+        if stored is not None:
+            return stored
+
+    if not approximate or len(matrices["ndids"]) < ANN_MIN_STUDENTS:
+        return None
+    index = get_ann_index(matrices)
+    if index is None:
+        return None
+    idx, scores = index.query(matrices, matrices["rows"][user_id], weights, k, n_probe=n_probe)
+    if len(idx) < min(k, len(matrices["ndids"]) - 1):
+        return None  # probed lists held fewer than k students
+    return [(matrices["ndids"][i], float(s)) for i, s in zip(idx, scores)]
+
+def nearest_students(user_id, engine, weights, k, n_probe=None):
+    # top k [(ndid, score)]; exact scoring when neither shortcut applies
+    matrices = _matrices_with_user(user_id, engine)
+    top = _top_students(user_id, matrices, weights, k, engine, n_probe)
+    if top is None:
+        # small cohort, or our matrices were replaced while we held them: score exactly
+        scores = combine_group_scores(cached_group_scores(user_id, matrices), weights)
+        return rank_scores(user_id, matrices, scores, n=k)
+    return top
+
+def return_similarities_weighted(user_id, engine, weights, n=None):
+    if n:
+        return nearest_students(user_id, engine, weights, n)
+    return similarity_ranking(user_id, engine, weights).all()
+
+def return_similarities_page(user_id, engine, weights, offset, limit, n=None, cache=None):
+    # one page of /algorithm: (ranks [offset, offset + limit) of the top n (everyone
+    # when n is None), number of ranks paged through); cache = SimilarityCache or None.
+    # Pages within the first NEIGHBOR_K ranks under default weights come from the
+    # precomputed table whenever it can answer exactly; ?n= pages of a cohort past
+    # ANN_MIN_STUDENTS come from the IVF index
+    matrices = _matrices_with_user(user_id, engine)
+    total = len(matrices["ndids"]) - 1
+    if n is not None:
+        total = max(0, min(n, total))
+    limit = max(0, min(limit, total - offset))
+
+    if limit > 0:
+        top = _top_students(user_id, matrices, weights, offset + limit, engine, approximate=n is not None)
+        if top is not None:
+            return top[offset:], total
+
+    if cache is not None:
+        ranking = _cached_ranking(user_id, matrices, weights, cache)
+    else:
+        scores = combine_group_scores(cached_group_scores(user_id, matrices), weights)
+        ranking = LazyRanking(matrices["ndids"], matrices["rows"], scores, exclude_row=matrices["rows"][user_id])
+    return ranking.page(offset, limit), total
 
 # -- Testing --
 
@@ -401,7 +2051,7 @@ def main():
     prof.disable()
 
     # Test results
-    dims = {k: len(v) for k, v in encoded[test_ndid].items()}
+    dims = {k: v["dense"].shape[1] + v["sparse"].shape[1] for k, v in encoded[test_ndid].items()}
     print(f"\nSummary:")
     print(f"- students: {len(encoded)}")
     print(f"- dims: {dims} (total={sum(dims.values())})")
@@ -413,6 +2063,10 @@ def main():
           f"items={encode_stats['items']}, time={encode_stats['secs']:.3f}s, "
           f"avg_batch={avg_batch:.2f}")
 
+    cache = get_text_cache()
+    if cache is not None:
+        print(f"- text embedding cache: {cache.stats()}")
+
     print("\nPhase timings (s):")
     for k in ["load_students", "fit_encoders", "encode_all_students", "weighted_top10"]:
         if k in times:
@@ -0,0 +1,304 @@
+# approximate nearest neighbours (IVF) for student similarity at scale
+import argparse
+import time
+import numpy as np
+from scipy import sparse
+from vector_storage import dense_dot, dense_rows
+
+GROUPS = ("academics", "professional", "background")
+
+DEFAULT_N_PROBE = 8
+# rows per chunk when assigning the whole cohort to lists (bounds memory)
+ASSIGN_CHUNK = 8192
+
+def _active_weights(weights):
+    # same rule as alg.score_against_all: skip non-positive / unknown groups
+    return [(g, float(w)) for g, w in weights.items() if g in GROUPS and w > 0]
+
+def _user_parts(matrices, row):
+    return {
+        g: (dense_rows(matrices[g], row), matrices[g]["sparse"][row].toarray().ravel())
+        for g in GROUPS
+    }
+
+class IVFIndex:
+    """
+    Inverted-file index over the similarity matrices built by alg.py.
+
+    Rows are clustered with spherical k-means over the unweighted concatenation
+    of every group's dense and sparse parts. Since each group is unit-normalized,
+    weighting the query side only ([w_g * u_g] . [x_g]) reproduces
+    alg.score_against_all, so one index serves every slider setting.
+    The index only stores centroids and list membership; vectors stay in the
+    matrices passed to each call.
+
+    Knobs: n_lists (more lists -> fewer candidates per probe, faster, lower
+    recall) and n_probe (lists scanned per query -> higher recall, slower).
+    """
+
+    def __init__(self, n_lists=None, n_probe=DEFAULT_N_PROBE, n_iter=10, sample_size=None, seed=0):
+        self.n_lists = n_lists
+        self.n_probe = n_probe
+        self.n_iter = n_iter
+        self.sample_size = sample_size
+        self.seed = seed
+        self.centroids = None  # {group: {"dense": (L, d), "sparse": (L, s)}}, both dense arrays
+        self.assign = np.zeros(0, dtype=np.int32)
+        self._order = None
+        self._offsets = None
+        # generation of the matrices the assignments match (kept by alg.py)
+        self.generation = None
+
+    # -- building --
+    def _centroid_sims(self, matrices, rows):
+        sims = None
+        for g in GROUPS:
+            D = dense_rows(matrices[g], rows)
+            S = matrices[g]["sparse"][rows]
+            part = D @ self.centroids[g]["dense"].T + S @ self.centroids[g]["sparse"].T
+            sims = part if sims is None else sims + part
+        return np.asarray(sims)
+
+    def _normalize_centroids(self):
+        sq = sum(
+            np.einsum("ij,ij->i", c["dense"], c["dense"]) + np.einsum("ij,ij->i", c["sparse"], c["sparse"])
+            for c in self.centroids.values()
+        )
+        norms = np.sqrt(sq)
+        norms[norms == 0] = 1.0
+        for c in self.centroids.values():
+            c["dense"] /= norms[:, None]
+            c["sparse"] /= norms[:, None]
+
+    def build(self, matrices):
+        N = len(matrices["ndids"])
+        if N == 0:
+            raise ValueError("Cannot build an index over an empty cohort")
+        rng = np.random.default_rng(self.seed)
+        L = min(self.n_lists or max(1, int(np.sqrt(N))), N)
+        self.n_lists = L
+
+        # k-means is trained on a sample; every row is assigned afterwards
+        sample_size = min(N, self.sample_size or L * 64)
+        sample = np.sort(rng.choice(N, size=sample_size, replace=False))
+        init = sample[rng.choice(sample_size, size=L, replace=False)]
+        self.centroids = {
+            g: {
+                "dense": np.array(dense_rows(matrices[g], init), dtype=np.float32),
+                "sparse": matrices[g]["sparse"][init].toarray().astype(np.float32),
+            }
+            for g in GROUPS
+        }
+        self._normalize_centroids()
+
+        for _ in range(self.n_iter):
+            labels = self._centroid_sims(matrices, sample).argmax(axis=1)
+            A = sparse.csr_matrix(
+                (np.ones(sample_size, dtype=np.float32), (labels, np.arange(sample_size))),
+                shape=(L, sample_size),
+            )
+            counts = np.asarray(A.sum(axis=1)).ravel()
+            empty = np.flatnonzero(counts == 0)
+            for g in GROUPS:
+                self.centroids[g]["dense"] = np.asarray(A @ dense_rows(matrices[g], sample), dtype=np.float32)
+                self.centroids[g]["sparse"] = (A @ matrices[g]["sparse"][sample]).toarray().astype(np.float32)
+            if len(empty):
+                # reseed empty lists with random sample rows
+                reseed = sample[rng.choice(sample_size, size=len(empty), replace=False)]
+                for g in GROUPS:
+                    self.centroids[g]["dense"][empty] = dense_rows(matrices[g], reseed)
+                    self.centroids[g]["sparse"][empty] = matrices[g]["sparse"][reseed].toarray()
+            self._normalize_centroids()
+
+        self.assign = np.zeros(0, dtype=np.int32)
+        self.assign_rows(matrices, np.arange(N))
+        return self
+
+    # -- maintenance --
+    def assign_rows(self, matrices, rows):
+        # (re)assign rows to their nearest list; rows past the end are appended
+        rows = np.asarray(rows, dtype=np.intp)
+        if len(rows) == 0:
+            return
+        if rows.max() >= len(self.assign):
+            grown = np.zeros(rows.max() + 1, dtype=np.int32)
+            grown[:len(self.assign)] = self.assign
+            self.assign = grown
+        assign = self.assign.copy()
+        for i in range(0, len(rows), ASSIGN_CHUNK):
+            chunk = rows[i:i + ASSIGN_CHUNK]
+            assign[chunk] = self._centroid_sims(matrices, chunk).argmax(axis=1)
+        self.assign = assign
+        self._order = None
+
+    def take_rows(self, previous):
+        # follow a reordered cohort: previous[i] = old row of new row i, or -1 for a row
+        # the caller still has to assign_rows (parked on list 0 until then)
+        previous = np.asarray(previous, dtype=np.intp)
+        self.assign = np.where(previous >= 0, self.assign[np.maximum(previous, 0)], 0).astype(np.int32)
+        self._order = None
+
+    def remove_row(self, row):
+        # rows after it shift down by one, like the matrices do
+        self.assign = np.delete(self.assign, row)
+        self._order = None
+
+    def transform_sparse_centroids(self, fn):
+        # fn(group, csr) -> csr; used to follow vocabulary growth in the matrices.
+        # builds new arrays so a copy.copy() of the index can be changed safely
+        self.centroids = {
+            g: {
+                "dense": c["dense"],
+                "sparse": fn(g, sparse.csr_matrix(c["sparse"])).toarray().astype(np.float32),
+            }
+            for g, c in self.centroids.items()
+        }
+
+    def _lists(self):
+        if self._order is None:
+            order = np.argsort(self.assign, kind="stable")
+            offsets = np.searchsorted(self.assign[order], np.arange(self.n_lists + 1))
+            self._order, self._offsets = order, offsets
+        return self._order, self._offsets
+
+    # -- querying --
+    def query(self, matrices, user_row, weights, k, n_probe=None):
+        # -> (row indices, scores) of the approximate top k, best first
+        active = _active_weights(weights)
+        denom = sum(w for _, w in active)
+        N = len(matrices["ndids"])
+        if not active or k <= 0:
+            return np.zeros(0, dtype=np.intp), np.zeros(0)
+
+        user = _user_parts(matrices, user_row)
+        centroid_scores = np.zeros(self.n_lists, dtype=np.float32)
+        for g, w in active:
+            ud, us = user[g]
+            centroid_scores += w * (self.centroids[g]["dense"] @ ud + self.centroids[g]["sparse"] @ us)
+
+        n_probe = min(n_probe or self.n_probe, self.n_lists)
+        probe = np.argpartition(-centroid_scores, n_probe - 1)[:n_probe]
+        order, offsets = self._lists()
+        cand = np.concatenate([order[offsets[l]:offsets[l + 1]] for l in probe])
+        cand = cand[(cand != user_row) & (cand < N)]
+        if len(cand) == 0:
+            return cand, np.zeros(0)
+
+        scores = np.zeros(len(cand))
+        for g, w in active:
+            ud, us = user[g]
+            scores += w * (dense_dot(matrices[g], ud, cand) + matrices[g]["sparse"][cand] @ us)
+        scores /= denom
+
+        k = min(k, len(cand))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top], kind="stable")]
+        return cand[top], scores[top]
+
+# -- Benchmark --
+def synthetic_matrices(n, dim=384, vocab=(2000, 800, 600, 60, 40), seed=0):
+    # random cohort shaped like alg.encode_cohort output (clustered so ANN has structure)
+    rng = np.random.default_rng(seed)
+    n_topics = max(2, int(np.sqrt(n)) // 2)
+    topic = rng.integers(0, n_topics, n)
+    other = rng.integers(0, n_topics, n)
+    mix = rng.random(n).astype(np.float32)[:, None]
+
+    def dense(width):
+        centers = rng.standard_normal((n_topics, width)).astype(np.float32)
+        noise = rng.standard_normal((n, width)).astype(np.float32)
+        return mix * centers[topic] + (1 - mix) * centers[other] + noise
+
+    def labels(width, per_row):
+        cols = (topic[:, None] * 7 + rng.integers(0, max(1, width // 10), (n, per_row))) % width
+        random_cols = rng.integers(0, width, (n, per_row))
+        cols = np.where(rng.random((n, per_row)) < 0.5, cols, random_cols)
+        return sparse.csr_matrix(
+            (np.ones(n * per_row, dtype=np.float32), (np.repeat(np.arange(n), per_row), cols.ravel())),
+            shape=(n, width),
+        )
+
+    def unit(block):
+        D, S = block["dense"], block["sparse"].tocsr()
+        S.sum_duplicates()
+        norms = np.sqrt(np.einsum("ij,ij->i", D, D) + np.asarray(S.multiply(S).sum(axis=1)).ravel())
+        norms[norms == 0] = 1.0
+        S = sparse.diags(1.0 / norms).astype(np.float32) @ S
+        return {"dense": D / norms[:, None], "sparse": S.tocsr()}
+
+    courses, clubs, companies, towns, dorms = vocab
+    ndids = [f"{i:09d}" for i in range(n)]
+    return {
+        "ndids": ndids,
+        "rows": {x: i for i, x in enumerate(ndids)},
+        "academics": unit({"dense": dense(2 * dim), "sparse": labels(courses, 4)}),
+        "professional": unit({"dense": dense(2 * dim), "sparse": sparse.hstack([labels(clubs, 2), labels(companies, 1)])}),
+        "background": unit({"dense": np.zeros((n, 0), dtype=np.float32), "sparse": sparse.hstack([labels(towns, 1), labels(dorms, 1)])}),
+    }
+
+def _exact_top(matrices, row, weights, k):
+    active = _active_weights(weights)
+    user = _user_parts(matrices, row)
+    scores = np.zeros(len(matrices["ndids"]))
+    for g, w in active:
+        ud, us = user[g]
+        scores += w * (dense_dot(matrices[g], ud) + matrices[g]["sparse"] @ us)
+    scores[row] = -np.inf
+    top = np.argpartition(-scores, k - 1)[:k]
+    return top
+
+def benchmark(matrices, weights, k=10, n_queries=100, probes=(1, 2, 4, 8, 16, 32), index=None, seed=0):
+    # recall@k of the IVF answer against exact scoring, plus per-query latency
+    N = len(matrices["ndids"])
+    rng = np.random.default_rng(seed)
+    queries = rng.choice(N, size=min(n_queries, N), replace=False)
+
+    if index is None:
+        t0 = time.perf_counter()
+        index = IVFIndex().build(matrices)
+        print(f"[ann] built {index.n_lists} lists over {N} rows in {time.perf_counter() - t0:.2f}s")
+
+    t0 = time.perf_counter()
+    exact = {q: set(_exact_top(matrices, q, weights, k)) for q in queries}
+    exact_ms = (time.perf_counter() - t0) / len(queries) * 1000
+
+    results = []
+    for n_probe in probes:
+        if n_probe > index.n_lists:
+            break
+        hits = 0
+        t0 = time.perf_counter()
+        for q in queries:
+            idx, _ = index.query(matrices, q, weights, k, n_probe=n_probe)
+            hits += len(exact[q].intersection(idx.tolist()))
+        ms = (time.perf_counter() - t0) / len(queries) * 1000
+        results.append({"n_probe": n_probe, "recall": hits / (k * len(queries)), "ms_per_query": ms})
+
+    print(f"[ann] exact: {exact_ms:.2f} ms/query")
+    for r in results:
+        print(f"[ann] n_probe={r['n_probe']:>3}  recall@{k}={r['recall']:.3f}  {r['ms_per_query']:.2f} ms/query")
+    return {"exact_ms_per_query": exact_ms, "probes": results}
+
+def main():
+    parser = argparse.ArgumentParser(description="IVF recall vs exact benchmark")
+    parser.add_argument("--synthetic", type=int, default=0, help="benchmark on N random students instead of the DB")
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--queries", type=int, default=100)
+    parser.add_argument("--lists", type=int, default=None)
+    args = parser.parse_args()
+
+    if args.synthetic:
+        matrices = synthetic_matrices(args.synthetic)
+    else:
+        from sqlalchemy import create_engine
+        import alg
+        _, matrices = alg.get_similarity_state(create_engine(alg.DATABASE_URI, future=True))
+
+    index = IVFIndex(n_lists=args.lists)
+    t0 = time.perf_counter()
+    index.build(matrices)
+    print(f"[ann] built {index.n_lists} lists over {len(matrices['ndids'])} rows in {time.perf_counter() - t0:.2f}s")
+    benchmark(matrices, {g: 1.0 for g in GROUPS}, k=args.k, n_queries=args.queries, index=index)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,146 @@
+# persistent text -> embedding cache (sqlite file) for the recommendation algorithm
+import os
+import re
+import sqlite3
+import threading
+import time
+import numpy as np
+
+DEFAULT_CACHE_PATH = os.environ.get(
+    "EMBEDDING_CACHE_PATH",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "embedding_cache.sqlite3")
+)
+DEFAULT_MAX_ENTRIES = int(os.environ.get("EMBEDDING_CACHE_MAX", "100000"))
+
+# sqlite caps bound parameters per statement, so lookups go in chunks
+_LOOKUP_CHUNK = 500
+
+def normalize_text(text):
+    # collapse whitespace so " Computer  Science" and "Computer Science" share an entry
+    return re.sub(r"\s+", " ", text or "").strip()
+
+class TextEmbeddingCache:
+    """
+    Maps (model id, normalized text) to a float32 embedding stored as a blob.
+    Bounded to max_entries rows; least recently used rows are evicted first.
+    """
+
+    def __init__(self, path=DEFAULT_CACHE_PATH, max_entries=DEFAULT_MAX_ENTRIES):
+        self.path = path
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS text_embeddings (
+                model TEXT NOT NULL,
+                text TEXT NOT NULL,
+                dim INTEGER NOT NULL,
+                vector BLOB NOT NULL,
+                last_used REAL NOT NULL,
+                PRIMARY KEY (model, text)
+            )
+        """)
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS ix_text_embeddings_last_used ON text_embeddings (last_used)"
+        )
+        self._conn.commit()
+
+    def get_many(self, model_id, texts):
+        # returns {original text: embedding} for the texts that are cached
+        keys = {}
+        for t in texts:
+            keys.setdefault(normalize_text(t), []).append(t)
+
+        found = {}
+        now = time.time()
+        with self._lock:
+            norm = list(keys.keys())
+            for i in range(0, len(norm), _LOOKUP_CHUNK):
+                chunk = norm[i:i + _LOOKUP_CHUNK]
+                marks = ",".join("?" * len(chunk))
+                rows = self._conn.execute(
+                    f"SELECT text, vector FROM text_embeddings WHERE model = ? AND text IN ({marks})",
+                    [model_id] + chunk,
+                ).fetchall()
+                for text, blob in rows:
+                    found[text] = np.frombuffer(blob, dtype=np.float32)
+
+            if found:
+                try:
+                    self._conn.executemany(
+                        "UPDATE text_embeddings SET last_used = ? WHERE model = ? AND text = ?",
+                        [(now, model_id, t) for t in found],
+                    )
+                    self._conn.commit()
+                except sqlite3.Error:
+                    self._conn.rollback()
+                    raise
+
+            self.hits += len(found)
+            self.misses += len(keys) - len(found)
+
+        return {orig: found[n] for n, origs in keys.items() if n in found for orig in origs}
+
+    def put_many(self, model_id, embeddings):
+        # embeddings: {text: vector}
+        if not embeddings:
+            return
+        now = time.time()
+        rows = []
+        for text, vec in embeddings.items():
+            vec = np.asarray(vec, dtype=np.float32)
+            rows.append((model_id, normalize_text(text), vec.shape[0], vec.tobytes(), now))
+
+        with self._lock:
+            try:
+                self._conn.executemany(
+                    "INSERT OR REPLACE INTO text_embeddings (model, text, dim, vector, last_used) "
+                    "VALUES (?, ?, ?, ?, ?)",
+                    rows,
+                )
+                self._evict()
+                self._conn.commit()
+            except sqlite3.Error:
+                self._conn.rollback()  # don't leave a half-written transaction open
+                raise
+
+    def _evict(self):
+        # caller holds the lock
+        count = self._conn.execute("SELECT COUNT(*) FROM text_embeddings").fetchone()[0]
+        extra = count - self.max_entries
+        if extra <= 0:
+            return
+        self._conn.execute(
+            "DELETE FROM text_embeddings WHERE rowid IN "
+            "(SELECT rowid FROM text_embeddings ORDER BY last_used ASC LIMIT ?)",
+            (extra,),
+        )
+        self.evictions += extra
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM text_embeddings").fetchone()[0]
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "entries": len(self),
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": self.hits / total if total else 0.0,
+        }
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM text_embeddings")
+            self._conn.commit()
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,12 @@
+# one-off schema migrations for the embedding tables; run before deploying a new version
+from sqlalchemy import create_engine
+import alg
+
+def main():
+    engine = create_engine(alg.DATABASE_URI, future=True)
+    if not alg.migrate_embeddings_table(engine):
+        print("[migrate] nothing to migrate")
+    alg.ensure_embeddings_table(engine)
+
+if __name__ == "__main__":
+    main()
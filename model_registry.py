@@ -0,0 +1,155 @@
+# process-wide registry for the sentence transformer used by alg.py
+import os
+import resource
+import threading
+import time
+import numpy as np
+
+# hub name, used as the cache identity and as a fallback when the local copy is incomplete
+MODEL_NAME = "all-MiniLM-L6-v2"
+
+# local copy of the model shipped with the repo (models/)
+MODEL_DIR = os.environ.get(
+    "MODEL_DIR",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "models")
+)
+
+# CPU inference precision: "float32" (as shipped), "int8" (dynamic quantization of the
+# Linear layers) or "float16" (half weights). Non-float32 models get their own
+# registry key, so cached text embeddings never mix precisions.
+PRECISIONS = ("float32", "int8", "float16")
+MODEL_PRECISION = os.environ.get("MODEL_PRECISION", "float32")
+
+_WEIGHT_FILES = ("model.safetensors", "pytorch_model.bin")
+
+_MODELS = {}
+_STATS = {}
+_LOCK = threading.Lock()
+
+def _has_local_weights(path):
+    return os.path.isfile(os.path.join(path, "modules.json")) and any(
+        os.path.isfile(os.path.join(path, f)) for f in _WEIGHT_FILES
+    )
+
+def _load(name):
+    # imported here: sentence_transformers pulls in torch + transformers (seconds)
+    from sentence_transformers import SentenceTransformer
+
+    if name == MODEL_NAME and _has_local_weights(MODEL_DIR):
+        # offline: never touch the hub when the repo copy is complete
+        return SentenceTransformer(MODEL_DIR, device="cpu", local_files_only=True), MODEL_DIR
+    print(f"[model_registry] no local weights in {MODEL_DIR}, loading {name} by name")
+    return SentenceTransformer(name, device="cpu"), name
+
+def registry_key(name, precision):
+    return name if precision == "float32" else f"{name}@{precision}"
+
+def _with_precision(model, precision):
+    if precision == "float32":
+        return model
+    import torch
+    if precision == "int8":
+        # weights stored int8, activations quantized per batch; attention/LayerNorm stay float32
+        return torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+    return model.half()
+
+def _max_rss_bytes():
+    # ru_maxrss is KiB on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+def _param_bytes(model):
+    # parameters + buffers, plus weights of dynamically quantized Linear layers,
+    # which live in packed params that neither of those lists
+    total = sum(p.numel() * p.element_size() for p in model.parameters())
+    total += sum(b.numel() * b.element_size() for b in model.buffers())
+    for module in model.modules():
+        weight_bias = getattr(module, "_weight_bias", None)
+        if weight_bias is None:
+            continue
+        for t in weight_bias():
+            if t is not None:
+                total += t.numel() * t.element_size()
+    return total
+
+def get_model(name=MODEL_NAME, precision=MODEL_PRECISION):
+    if precision not in PRECISIONS:
+        raise ValueError(f"Unknown model precision: {precision}")
+    key = registry_key(name, precision)
+    model = _MODELS.get(key)
+    if model is not None:
+        return model
+
+    with _LOCK:
+        model = _MODELS.get(key)
+        if model is None:
+            rss_before = _max_rss_bytes()
+            t0 = time.perf_counter()
+            model, source = _load(name)
+            model = _with_precision(model, precision)
+            load_seconds = time.perf_counter() - t0
+
+            param_bytes = _param_bytes(model)
+            _STATS[key] = {
+                "source": source,
+                "precision": precision,
+                "load_seconds": load_seconds,
+                "param_bytes": param_bytes,
+                "max_rss_growth_bytes": _max_rss_bytes() - rss_before,
+                "warmup_seconds": None,
+            }
+            _MODELS[key] = model
+    return model
+
+def model_id(model):
+    # registry key (name + non-default precision) of a loaded model (falls back to the default name)
+    for name, m in _MODELS.items():
+        if m is model:
+            return name
+    return MODEL_NAME
+
+def warm_up(name=MODEL_NAME, precision=MODEL_PRECISION):
+    # load + one tiny encode so the first real request doesn't pay for it
+    model = get_model(name, precision)
+    key = registry_key(name, precision)
+    t0 = time.perf_counter()
+    model.encode(["warm up"])
+    _STATS[key]["warmup_seconds"] = time.perf_counter() - t0
+    return _STATS[key]
+
+def _unit(X):
+    X = np.asarray(X, dtype=np.float32)
+    norms = np.linalg.norm(X, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return X / norms
+
+def compare_precisions(texts, precisions=("int8", "float16"), name=MODEL_NAME, k=10, batch_size=256):
+    # {precision: cosine agreement with float32, text top-k overlap, texts/s} on the same texts
+    texts = list(dict.fromkeys(texts))
+    k = max(1, min(k, len(texts) - 1))
+    report = {}
+    reference = None
+    for precision in ("float32",) + tuple(p for p in precisions if p != "float32"):
+        model = get_model(name, precision)
+        model.encode(texts[:batch_size], batch_size=batch_size)  # warm
+        t0 = time.perf_counter()
+        emb = _unit(model.encode(texts, batch_size=batch_size))
+        seconds = time.perf_counter() - t0
+        entry = {"texts_per_second": len(texts) / seconds if seconds > 0 else float("inf")}
+        if reference is None:
+            reference = emb
+            ref_top = np.argsort(-(emb @ emb.T), axis=1)[:, 1:k + 1]
+        else:
+            cos = np.einsum("ij,ij->i", emb, reference)
+            top = np.argsort(-(emb @ emb.T), axis=1)[:, 1:k + 1]
+            entry.update({
+                "cosine_mean": float(cos.mean()),
+                "cosine_min": float(cos.min()),
+                f"overlap@{k}": float(np.mean([len(set(a) & set(b)) / k for a, b in zip(ref_top, top)])),
+                "speedup": entry["texts_per_second"] / report["float32"]["texts_per_second"],
+            })
+        report[precision] = entry
+    return report
+
+def model_stats():
+    # registry key -> load time / memory footprint of every model loaded in this process
+    return {name: dict(stats) for name, stats in list(_STATS.items())}
@@ -0,0 +1,124 @@
+# batch job: every student's top-K neighbours per feature group via blocked all-pairs similarity
+import argparse
+import multiprocessing
+import os
+import time
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from sqlalchemy import create_engine
+import alg
+from vector_storage import dense_rows
+
+# tile of the N x N product computed at once is ROW_BLOCK x COL_BLOCK floats per group
+ROW_BLOCK = int(os.environ.get("NEIGHBOR_ROW_BLOCK", "1024"))
+COL_BLOCK = int(os.environ.get("NEIGHBOR_COL_BLOCK", "8192"))
+
+# "default" = the combined score under DEFAULT_ALG_WEIGHTS; the rest are single groups
+NEIGHBOR_GROUPS = ("default",) + alg.SIMILARITY_GROUPS
+
+# matrices handed to forked pool workers (inherited, not pickled)
+_JOB = {}
+
+def _tile(matrices, rows, cols, weights):
+    # {group: (len(rows), len(cols)) scores} for one tile of the all-pairs product
+    out = {}
+    combined = np.zeros((rows.stop - rows.start, cols.stop - cols.start))
+    denom = 0.0
+    for g in alg.SIMILARITY_GROUPS:
+        S = matrices[g]["sparse"]
+        scores = dense_rows(matrices[g], rows) @ dense_rows(matrices[g], cols).T + (S[rows] @ S[cols].T).toarray()
+        out[g] = scores
+        w = weights.get(g, 0)
+        if w > 0:
+            combined += w * scores
+            denom += w
+    out["default"] = combined / denom if denom > 0 else combined
+    return out
+
+def _merge(best_idx, best_scores, tile_scores, cols, k):
+    # keep the k best of (current best, this tile) per row
+    tile_idx = np.broadcast_to(np.arange(cols.start, cols.stop, dtype=np.int32), tile_scores.shape)
+    cand_scores = np.hstack([best_scores, tile_scores])
+    cand_idx = np.hstack([best_idx, tile_idx])
+    top = np.argpartition(-cand_scores, k - 1, axis=1)[:, :k]
+    return np.take_along_axis(cand_idx, top, axis=1), np.take_along_axis(cand_scores, top, axis=1)
+
+def _row_block(start, stop, k, weights, col_block):
+    matrices = _JOB["matrices"]
+    n = len(matrices["ndids"])
+    rows = slice(start, stop)
+    best = {
+        g: (np.full((stop - start, k), -1, dtype=np.int32), np.full((stop - start, k), -np.inf))
+        for g in NEIGHBOR_GROUPS
+    }
+    for c in range(0, n, col_block):
+        cols = slice(c, min(n, c + col_block))
+        tiles = _tile(matrices, rows, cols, weights)
+        # nobody is their own neighbour
+        lo, hi = max(start, cols.start), min(stop, cols.stop)
+        diag = np.arange(lo, hi)
+        for g, scores in tiles.items():
+            scores[diag - start, diag - cols.start] = -np.inf
+            best[g] = _merge(best[g][0], best[g][1], scores, cols, k)
+
+    out = {}
+    for g, (idx, scores) in best.items():
+        order = np.argsort(-scores, axis=1, kind="stable")
+        out[g] = (np.take_along_axis(idx, order, axis=1), np.take_along_axis(scores, order, axis=1).astype(np.float32))
+    return start, out
+
+def compute_neighbors(matrices, k=alg.NEIGHBOR_K, weights=None, row_block=ROW_BLOCK, col_block=COL_BLOCK, processes=1):
+    # -> {group: (idx (N, k) int32, scores (N, k) float32)}, best first; idx -1 = no neighbour
+    weights = weights or alg.DEFAULT_ALG_WEIGHTS
+    n = len(matrices["ndids"])
+    k = max(1, min(k, n - 1))
+    result = {g: (np.full((n, k), -1, dtype=np.int32), np.zeros((n, k), dtype=np.float32)) for g in NEIGHBOR_GROUPS}
+    blocks = [(s, min(n, s + row_block)) for s in range(0, n, row_block)]
+
+    _JOB["matrices"] = matrices
+    try:
+        if processes > 1 and "fork" in multiprocessing.get_all_start_methods():
+            ctx = multiprocessing.get_context("fork")
+            with ProcessPoolExecutor(max_workers=processes, mp_context=ctx) as pool:
+                futures = [pool.submit(_row_block, s, e, k, weights, col_block) for s, e in blocks]
+                parts = [f.result() for f in futures]
+        else:
+            parts = [_row_block(s, e, k, weights, col_block) for s, e in blocks]
+    finally:
+        _JOB.clear()
+
+    for start, out in parts:
+        for g, (idx, scores) in out.items():
+            stop = start + len(idx)
+            result[g][0][start:stop] = idx
+            result[g][1][start:stop] = scores
+    return result
+
+def main():
+    parser = argparse.ArgumentParser(description="Precompute each student's top-K neighbours")
+    parser.add_argument("--k", type=int, default=alg.NEIGHBOR_K)
+    parser.add_argument("--processes", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--row-block", type=int, default=ROW_BLOCK)
+    parser.add_argument("--col-block", type=int, default=COL_BLOCK)
+    args = parser.parse_args()
+
+    engine = create_engine(alg.DATABASE_URI, future=True)
+    encoders, matrices = alg.get_similarity_state(engine)
+    # taken with the matrices: students edited while this runs are scored live by the app
+    stamp = alg.neighbor_stamp(encoders)
+
+    t0 = time.perf_counter()
+    neighbors = compute_neighbors(
+        matrices, k=args.k, row_block=args.row_block, col_block=args.col_block, processes=args.processes
+    )
+    print(f"[neighbors] all-pairs top-{args.k} for {len(matrices['ndids'])} students in {time.perf_counter() - t0:.2f}s")
+
+    alg.ensure_embeddings_table(engine)
+    if not alg.SNAPSHOT_DIR:
+        # each process then starts its own edit history, which these rows cannot match
+        print("[neighbors] SNAPSHOT_DIR is off: the app will not use these rows and scores live")
+    stats = alg.save_neighbors_to_db(neighbors, matrices["ndids"], stamp, engine)
+    print(f"[neighbors] wrote {stats['rows']} rows in {stats['seconds']:.2f}s")
+
+if __name__ == "__main__":
+    main()
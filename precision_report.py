@@ -0,0 +1,62 @@
+# accuracy / throughput of reduced-precision MiniLM inference (MODEL_PRECISION) against float32
+import argparse
+import json
+import random
+import time
+from sqlalchemy import create_engine
+import alg
+import model_registry
+
+def cohort_texts(students):
+    texts = []
+    for student in students:
+        texts.append(student["major"])
+        texts.append(student["minor"])
+        texts.extend(student["clubs"])
+        texts.extend(student["internships"])
+    return [t for t in dict.fromkeys(texts) if t]
+
+def ranking_overlap(students, encoders, precisions, k=10, n_queries=200):
+    # student-level: how much of each sampled student's float32 top k survives, and encode time
+    report = {}
+    reference = None
+    for precision in ("float32",) + tuple(p for p in precisions if p != "float32"):
+        model = model_registry.get_model(alg.MODEL_NAME, precision)
+        t0 = time.perf_counter()
+        matrices = alg.encode_cohort(students, dict(encoders, model=model))
+        entry = {"encode_seconds": time.perf_counter() - t0}
+        if reference is None:
+            reference = matrices
+        else:
+            entry[f"overlap@{k}"] = alg.overlap_at_k(reference, matrices, k=k, n_queries=n_queries)
+        report[precision] = entry
+    return report
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare reduced-precision encoder inference with float32")
+    parser.add_argument("--precisions", default="int8,float16")
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--texts", type=int, default=5000, help="distinct cohort texts sampled for the text report")
+    parser.add_argument("--queries", type=int, default=200)
+    args = parser.parse_args()
+    precisions = tuple(p for p in args.precisions.split(",") if p)
+
+    engine = create_engine(alg.DATABASE_URI, future=True)
+    students = list(alg.load_student_table(engine))
+    texts = cohort_texts(students)
+    random.Random(0).shuffle(texts)
+
+    # text cache off, so every precision really runs the model
+    alg._TEXT_CACHE = None
+    alg.DEFAULT_CACHE_PATH = ""
+
+    print(f"[precision_report] {len(students)} students, {len(texts)} distinct texts")
+    text_report = model_registry.compare_precisions(texts[:args.texts], precisions, k=args.k)
+    print("[precision_report] texts:", json.dumps(text_report, indent=2))
+
+    encoders = alg.fit_encoders(students)
+    cohort_report = ranking_overlap(students, encoders, precisions, k=args.k, n_queries=args.queries)
+    print("[precision_report] cohort:", json.dumps(cohort_report, indent=2))
+
+if __name__ == "__main__":
+    main()
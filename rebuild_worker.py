@@ -0,0 +1,204 @@
+# background maintenance of the similarity snapshot, so requests never wait on embeddings
+import os
+import threading
+import time
+import alg
+
+# seconds to keep collecting events after the first one before building
+REBUILD_DEBOUNCE = float(os.environ.get("REBUILD_DEBOUNCE", "0.5"))
+
+# a burst touching at least this many students becomes one full rebuild
+REBUILD_FULL_THRESHOLD = int(os.environ.get("REBUILD_FULL_THRESHOLD", "50"))
+
+# failed events are queued again up to this many times, after REBUILD_RETRY_DELAY seconds
+REBUILD_MAX_RETRIES = int(os.environ.get("REBUILD_MAX_RETRIES", "5"))
+REBUILD_RETRY_DELAY = float(os.environ.get("REBUILD_RETRY_DELAY", "5"))
+
+class RebuildWorker:
+    """
+    In-process job queue with one worker thread.
+
+    Events are keyed by NDID, so repeated edits of the same student collapse
+    into one job. A burst is drained as a whole after a short debounce. Large
+    bursts (or an explicit request_rebuild) run one rebuild_on_new_user;
+    small ones go through alg's incremental update/remove. Either path swaps
+    alg's state under its lock, so readers only ever see whole snapshots.
+    Events that fail are queued again (unless a newer one for the same NDID
+    arrived) and dropped after max_retries attempts.
+    """
+
+    def __init__(self, engine, debounce=REBUILD_DEBOUNCE, full_threshold=REBUILD_FULL_THRESHOLD,
+                 max_retries=REBUILD_MAX_RETRIES, retry_delay=REBUILD_RETRY_DELAY):
+        self.engine = engine
+        self.debounce = debounce
+        self.full_threshold = full_threshold
+        self.max_retries = max_retries
+        self.retry_delay = retry_delay
+        self._pending = {}  # ndid -> "changed" | "removed"
+        self._full = False
+        self._attempts = {}  # ndid (or None for a full rebuild) -> failed attempts so far
+        self._retry_at = 0.0
+        self._busy = False
+        self._cond = threading.Condition()
+        self._thread = None
+        self._stats = {
+            "events": 0,
+            "builds": 0,
+            "full_builds": 0,
+            "idf_refreshes": 0,
+            "idf_drift": 0.0,
+            "failures": 0,
+            "retries": 0,
+            "dropped": 0,
+            "last_build_seconds": None,
+            "last_build_at": None,
+            "last_build_students": 0,
+            "last_error": None,
+        }
+
+    def start(self):
+        with self._cond:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="rebuild-worker", daemon=True)
+                self._thread.start()
+        return self
+
+    # -- producers (request threads) --
+    def _submit(self, ndid, kind):
+        with self._cond:
+            self._pending[ndid] = kind
+            self._stats["events"] += 1
+            self._cond.notify_all()
+        self.start()
+
+    def student_changed(self, ndid):
+        self._submit(ndid, "changed")
+
+    def student_removed(self, ndid):
+        self._submit(ndid, "removed")
+
+    def request_rebuild(self):
+        with self._cond:
+            self._full = True
+            self._stats["events"] += 1
+            self._cond.notify_all()
+        self.start()
+
+    # -- observability --
+    def queue_depth(self):
+        with self._cond:
+            return len(self._pending) + (1 if self._full else 0)
+
+    def stats(self):
+        with self._cond:
+            out = dict(self._stats)
+            out["queue_depth"] = len(self._pending) + (1 if self._full else 0)
+            out["busy"] = self._busy
+        return out
+
+    def wait_idle(self, timeout=None):
+        # True once nothing is queued or building (for scripts and shutdown)
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            while self._pending or self._full or self._busy:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._cond.wait(remaining)
+        return True
+
+    # -- worker --
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._pending and not self._full:
+                    self._cond.wait()
+
+            time.sleep(self.debounce)  # let the rest of the burst arrive
+            time.sleep(max(0.0, self._retry_at - time.monotonic()))  # back off after a failure
+
+            with self._cond:
+                pending, self._pending = self._pending, {}
+                full, self._full = self._full, False
+                self._busy = True
+
+            t0 = time.perf_counter()
+            ran_full, failed, errors = False, {}, []
+            try:
+                ran_full, failed, errors = self._build(pending, full)
+            except Exception as e:
+                # rebuild / state load failed: nothing in the burst was applied
+                print(f"[rebuild_worker] Build failed: {e}")
+                failed, errors = dict(pending), [e]
+                ran_full = full or len(pending) >= self.full_threshold
+                if ran_full:
+                    failed[None] = "full"
+            seconds = time.perf_counter() - t0
+
+            with self._cond:
+                self._busy = False
+                self._stats["builds"] += 1
+                self._stats["full_builds"] += int(ran_full and None not in failed)
+                self._stats["last_build_seconds"] = seconds
+                self._stats["last_build_at"] = time.time()
+                self._stats["last_build_students"] = len(pending)
+                for ndid in pending:
+                    if ndid not in failed:
+                        self._attempts.pop(ndid, None)
+                if ran_full and None not in failed:
+                    self._attempts.pop(None, None)
+                if errors:
+                    self._stats["failures"] += 1
+                    self._stats["last_error"] = str(errors[-1])
+                    self._requeue(failed)
+                self._cond.notify_all()
+
+    def _requeue(self, failed):
+        # caller holds self._cond; a newer event for the same NDID replaces the failed one
+        for ndid, kind in failed.items():
+            attempts = self._attempts.get(ndid, 0) + 1
+            if attempts > self.max_retries:
+                self._attempts.pop(ndid, None)
+                self._stats["dropped"] += 1
+                print(f"[rebuild_worker] Giving up on {ndid or 'full rebuild'} after {attempts - 1} retries")
+                continue
+            self._attempts[ndid] = attempts
+            self._stats["retries"] += 1
+            if ndid is None:
+                self._full = True
+            else:
+                self._pending.setdefault(ndid, kind)
+        self._retry_at = time.monotonic() + self.retry_delay
+
+    def _build(self, pending, full):
+        # -> (whether a full rebuild ran, {ndid: kind} that failed, errors)
+        if full or len(pending) >= self.full_threshold:
+            alg.rebuild_on_new_user(self.engine)
+            return True, {}, []
+        alg.get_similarity_state(self.engine)  # load (or build) the snapshot the updates apply to
+        failed, errors = {}, []
+        for ndid, kind in pending.items():
+            try:
+                if kind == "removed":
+                    alg.remove_student_embedding(ndid, self.engine)
+                else:
+                    alg.update_student_embedding(ndid, self.engine)
+            except Exception as e:
+                print(f"[rebuild_worker] Could not apply {kind} {ndid}: {e}")
+                failed[ndid] = kind
+                errors.append(e)
+
+        # label counts moved on every update; re-weight all rows once idf has drifted enough
+        drift = alg.idf_drift()
+        try:
+            if drift > alg.IDF_DRIFT_THRESHOLD and alg.refresh_label_weights(self.engine):
+                with self._cond:
+                    self._stats["idf_refreshes"] += 1
+                drift = alg.idf_drift()
+        except Exception as e:
+            # the next burst checks the drift again
+            print(f"[rebuild_worker] idf refresh failed: {e}")
+            errors.append(e)
+        with self._cond:
+            self._stats["idf_drift"] = drift
+        return False, failed, errors
@@ -0,0 +1,203 @@
+# bounded cache of per-user score vectors for /algorithm, invalidated by snapshot version
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+import numpy as np
+
+# "memory" (per process) or "sqlite" (one file shared by every worker on the host)
+DEFAULT_BACKEND = os.environ.get("SIMILARITY_CACHE_BACKEND", "memory")
+DEFAULT_MAX_BYTES = int(os.environ.get("SIMILARITY_CACHE_MAX_BYTES", str(256 * 1024 * 1024)))
+DEFAULT_CACHE_PATH = os.environ.get(
+    "SIMILARITY_CACHE_PATH",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "similarity_cache.sqlite3")
+)
+
+class MemoryBackend:
+    """In-process LRU over entry bytes."""
+
+    def __init__(self, max_bytes=DEFAULT_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self._entries = OrderedDict()  # key -> (version, scores)
+        self._lock = threading.Lock()
+
+    def get(self, key, version):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] != version:
+                return None
+            self._entries.move_to_end(key)
+            return entry[1]
+
+    def put(self, key, version, scores):
+        # -> number of entries evicted
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.bytes -= old[1].nbytes
+            self._entries[key] = (version, scores)
+            self.bytes += scores.nbytes
+            evicted = 0
+            while self.bytes > self.max_bytes and len(self._entries) > 1:
+                _, (_, dropped) = self._entries.popitem(last=False)
+                self.bytes -= dropped.nbytes
+                evicted += 1
+            return evicted
+
+    def drop_other_versions(self, version):
+        with self._lock:
+            stale = [k for k, (v, _) in self._entries.items() if v != version]
+            for k in stale:
+                self.bytes -= self._entries.pop(k)[1].nbytes
+            return len(stale)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.bytes = 0
+
+class SqliteBackend:
+    """LRU over entry bytes in a sqlite file, so worker processes share entries."""
+
+    def __init__(self, path=DEFAULT_CACHE_PATH, max_bytes=DEFAULT_MAX_BYTES):
+        self.path = path
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=5)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS similarity_scores (
+                key TEXT PRIMARY KEY,
+                version TEXT NOT NULL,
+                scores BLOB NOT NULL,
+                nbytes INTEGER NOT NULL,
+                last_used REAL NOT NULL
+            )
+        """)
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS ix_similarity_scores_last_used ON similarity_scores (last_used)"
+        )
+        self._conn.commit()
+
+    @property
+    def bytes(self):
+        with self._lock:
+            return self._conn.execute("SELECT COALESCE(SUM(nbytes), 0) FROM similarity_scores").fetchone()[0]
+
+    def get(self, key, version):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT scores FROM similarity_scores WHERE key = ? AND version = ?", (key, version)
+            ).fetchone()
+            if row is None:
+                return None
+            self._conn.execute("UPDATE similarity_scores SET last_used = ? WHERE key = ?", (time.time(), key))
+            self._conn.commit()
+        return np.frombuffer(row[0], dtype=np.float64)
+
+    def put(self, key, version, scores):
+        scores = np.ascontiguousarray(scores, dtype=np.float64)
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO similarity_scores (key, version, scores, nbytes, last_used) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (key, version, scores.tobytes(), scores.nbytes, time.time()),
+            )
+            evicted = 0
+            total = self._conn.execute("SELECT COALESCE(SUM(nbytes), 0) FROM similarity_scores").fetchone()[0]
+            while total > self.max_bytes:
+                row = self._conn.execute(
+                    "SELECT key, nbytes FROM similarity_scores WHERE key != ? ORDER BY last_used ASC LIMIT 1", (key,)
+                ).fetchone()
+                if row is None:
+                    break
+                self._conn.execute("DELETE FROM similarity_scores WHERE key = ?", (row[0],))
+                total -= row[1]
+                evicted += 1
+            self._conn.commit()
+            return evicted
+
+    def drop_other_versions(self, version):
+        with self._lock:
+            cur = self._conn.execute("DELETE FROM similarity_scores WHERE version != ?", (version,))
+            self._conn.commit()
+            return cur.rowcount
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM similarity_scores").fetchone()[0]
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM similarity_scores")
+            self._conn.commit()
+
+def make_backend(name=DEFAULT_BACKEND, max_bytes=DEFAULT_MAX_BYTES):
+    if name == "sqlite":
+        return SqliteBackend(max_bytes=max_bytes)
+    if name == "memory":
+        return MemoryBackend(max_bytes=max_bytes)
+    raise ValueError(f"Unknown similarity cache backend: {name}")
+
+class SimilarityCache:
+    """
+    Score vectors keyed by (user, weights), valid for one embedding snapshot
+    version. Seeing a new version drops everything cached for older ones, so
+    signups, profile edits and rebuilds invalidate without a TTL.
+    """
+
+    def __init__(self, backend=None):
+        self.backend = backend if backend is not None else make_backend()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self._version = None
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(ndid, weight_key):
+        return f"{ndid}|{weight_key}"
+
+    def _observe(self, version):
+        with self._lock:
+            if version == self._version:
+                return
+            self._version = version
+        self.invalidations += self.backend.drop_other_versions(version)
+
+    def get(self, ndid, weight_key, version):
+        self._observe(version)
+        scores = self.backend.get(self.key(ndid, weight_key), version)
+        if scores is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return scores
+
+    def put(self, ndid, weight_key, version, scores):
+        self._observe(version)
+        self.evictions += self.backend.put(self.key(ndid, weight_key), version, scores)
+
+    def clear(self):
+        self.backend.clear()
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "backend": type(self.backend).__name__,
+            "entries": len(self.backend),
+            "bytes": self.backend.bytes,
+            "max_bytes": self.backend.max_bytes,
+            "version": self._version,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations,
+            "hit_rate": self.hits / total if total else 0.0,
+        }
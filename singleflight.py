@@ -0,0 +1,68 @@
+# coalesce concurrent identical computations and cap how many run at once
+import os
+import threading
+
+# recommendation computations allowed to run at the same time in this process
+DEFAULT_CONCURRENCY = int(os.environ.get("RECOMMEND_CONCURRENCY", str(os.cpu_count() or 4)))
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+class SingleFlight:
+    """
+    do(key, fn) runs fn once per key at a time: callers arriving while a call
+    with the same key is in flight wait for it and get its result (or error).
+    Leaders also take a slot of a shared semaphore, so a burst of distinct
+    keys cannot run more than `concurrency` computations in parallel.
+    """
+
+    def __init__(self, concurrency=DEFAULT_CONCURRENCY):
+        self.concurrency = concurrency
+        self._slots = threading.BoundedSemaphore(concurrency)
+        self._lock = threading.Lock()
+        self._calls = {}
+        self.executions = 0
+        self.coalesced = 0
+
+    def do(self, key, fn):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+                self.executions += 1
+            else:
+                self.coalesced += 1
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            with self._slots:
+                call.result = fn()
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        return call.result
+
+    def in_flight(self):
+        with self._lock:
+            return len(self._calls)
+
+    def stats(self):
+        return {
+            "concurrency": self.concurrency,
+            "in_flight": self.in_flight(),
+            "executions": self.executions,
+            "coalesced": self.coalesced,
+        }
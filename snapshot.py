@@ -0,0 +1,180 @@
+# versioned, read-only similarity snapshots shared by every worker process via mmap
+import fcntl
+import json
+import os
+import struct
+from contextlib import contextmanager
+import numpy as np
+from scipy import sparse
+
+MAGIC = b"ICSNAP01"
+ALIGN = 64
+# published snapshots kept on disk; processes still mapping an older file keep it alive
+KEEP_SNAPSHOTS = 2
+
+POINTER_FILE = "CURRENT"
+LOCK_FILE = ".lock"
+
+def _aligned(n):
+    return (n + ALIGN - 1) // ALIGN * ALIGN
+
+def _arrays(matrices, groups):
+    # name -> contiguous array, in file order
+    out = {}
+    for g in groups:
+        S, D = matrices[g]["sparse"], matrices[g]["dense"]
+        # compact dense storage (vector_storage.py) is written as is, everything else as float32
+        dtype = D.dtype if D.dtype in (np.float16, np.int8) else np.float32
+        out[f"{g}.dense"] = np.ascontiguousarray(D, dtype=dtype)
+        if matrices[g].get("scale") is not None:
+            out[f"{g}.scale"] = np.ascontiguousarray(matrices[g]["scale"], dtype=np.float32)
+        out[f"{g}.data"] = np.ascontiguousarray(S.data, dtype=np.float32)
+        out[f"{g}.indices"] = np.ascontiguousarray(S.indices, dtype=np.int32)
+        out[f"{g}.indptr"] = np.ascontiguousarray(S.indptr, dtype=np.int32)
+    return out
+
+def write_snapshot(path, version, matrices, groups, payload=b"", meta=None):
+    # one file: magic | header length | JSON header | 64-byte aligned raw arrays
+    arrays = _arrays(matrices, groups)
+    arrays["payload"] = np.frombuffer(payload, dtype=np.uint8)
+
+    header = {
+        "version": version,
+        "groups": list(groups),
+        "ndids": list(matrices["ndids"]),
+        "shapes": {g: list(matrices[g]["sparse"].shape) for g in groups},
+        "meta": meta or {},
+        "arrays": {},
+    }
+    # offsets depend on the header size, so lay out twice until it is stable
+    header_len = 0
+    while True:
+        offset = _aligned(len(MAGIC) + 8 + header_len)
+        for name, a in arrays.items():
+            header["arrays"][name] = {"offset": offset, "dtype": a.dtype.str, "shape": list(a.shape)}
+            offset = _aligned(offset + a.nbytes)
+        encoded = json.dumps(header).encode("utf-8")
+        if len(encoded) == header_len:
+            break
+        header_len = len(encoded)
+
+    tmp = path + ".tmp"
+    with open(tmp, "wb") as f:
+        f.write(MAGIC)
+        f.write(struct.pack("<Q", len(encoded)))
+        f.write(encoded)
+        for name, a in arrays.items():
+            f.seek(header["arrays"][name]["offset"])
+            f.write(memoryview(a).cast("B") if a.nbytes else b"")
+        f.truncate(_aligned(f.tell()))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+def read_snapshot(path):
+    # -> (header, matrices, payload); arrays are read-only views of one mmap
+    with open(path, "rb") as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f"{path} is not a similarity snapshot")
+        header_len = struct.unpack("<Q", f.read(8))[0]
+        header = json.loads(f.read(header_len).decode("utf-8"))
+
+    mm = np.memmap(path, dtype=np.uint8, mode="r")
+
+    def view(name):
+        spec = header["arrays"][name]
+        dtype = np.dtype(spec["dtype"])
+        count = int(np.prod(spec["shape"])) if spec["shape"] else 1
+        return np.frombuffer(mm, dtype=dtype, count=count, offset=spec["offset"]).reshape(spec["shape"])
+
+    ndids = header["ndids"]
+    matrices = {"ndids": ndids, "rows": {n: i for i, n in enumerate(ndids)}}
+    for g in header["groups"]:
+        S = sparse.csr_matrix(
+            (view(f"{g}.data"), view(f"{g}.indices"), view(f"{g}.indptr")),
+            shape=tuple(header["shapes"][g]),
+            copy=False,
+        )
+        matrices[g] = {"dense": view(f"{g}.dense"), "sparse": S}
+        if f"{g}.scale" in header["arrays"]:
+            matrices[g]["scale"] = view(f"{g}.scale")
+    return header, matrices, view("payload").tobytes()
+
+class SnapshotStore:
+    """
+    Directory of snapshot files plus a CURRENT pointer to the live one.
+
+    publish() writes a new file and flips CURRENT atomically; poll() maps the
+    file CURRENT points to whenever it changed since the last poll. Mapped
+    pages are shared by every process on the host, so resident memory stays
+    flat as workers are added. lock() serializes writers across processes.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self._seen = None  # (inode, mtime) of the pointer last polled
+        self.version = None
+
+    def _path(self, name):
+        return os.path.join(self.directory, name)
+
+    @contextmanager
+    def lock(self):
+        with open(self._path(LOCK_FILE), "a") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def forget(self):
+        # the last poll's snapshot could not be installed; map CURRENT again next time
+        self._seen = None
+        self.version = None
+
+    def current_version(self):
+        try:
+            with open(self._path(POINTER_FILE)) as f:
+                return f.read().strip() or None
+        except FileNotFoundError:
+            return None
+
+    def publish(self, version, matrices, groups, payload=b"", meta=None):
+        write_snapshot(self._path(f"{version}.snap"), version, matrices, groups, payload, meta)
+        tmp = self._path(POINTER_FILE + ".tmp")
+        with open(tmp, "w") as f:
+            f.write(version)
+        os.replace(tmp, self._path(POINTER_FILE))
+        self._prune(version)
+
+    def _prune(self, keep_version):
+        snaps = [n for n in os.listdir(self.directory) if n.endswith(".snap")]
+        snaps.sort(key=lambda n: os.path.getmtime(self._path(n)), reverse=True)
+        keep = {f"{keep_version}.snap"}
+        keep.update(snaps[:KEEP_SNAPSHOTS])
+        for name in snaps:
+            if name not in keep:
+                try:
+                    os.remove(self._path(name))
+                except FileNotFoundError:
+                    pass
+
+    def poll(self):
+        # (header, matrices, payload) if CURRENT moved since last poll, else None
+        try:
+            st = os.stat(self._path(POINTER_FILE))
+        except FileNotFoundError:
+            return None
+        key = (st.st_ino, st.st_mtime_ns)
+        if key == self._seen:
+            return None
+
+        version = self.current_version()
+        if version is None or version == self.version:
+            self._seen = key
+            return None
+        header, matrices, payload = read_snapshot(self._path(f"{version}.snap"))
+        self._seen = key
+        self.version = version
+        return header, matrices, payload
@@ -0,0 +1,54 @@
+# cold-start import cost of the web app, by top-level package (python -X importtime)
+import argparse
+import os
+import subprocess
+import sys
+from collections import defaultdict
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+# must stay out of `import app`; they load on the first encode / encoder fit
+HEAVY = ("torch", "transformers", "sentence_transformers", "sklearn")
+
+def import_profile(module="app", extra=""):
+    # -> ({package imported by module: cumulative seconds}, total seconds, heavy modules loaded)
+    code = f"import sys, {module}{extra}; print(','.join(m for m in {HEAVY!r} if m in sys.modules))"
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        cwd=ROOT, capture_output=True, text=True, check=True,
+    )
+    by_package = defaultdict(float)
+    total = 0.0
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:") or "imported package" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        depth = (len(name) - len(name.lstrip(" ")) - 1) // 2
+        if depth == 0:
+            total += int(cumulative) / 1e6
+        # what `module` itself imports (depth 1), attributed to the first package to load it
+        if depth == 1:
+            by_package[name.strip().split(".")[0]] += int(cumulative) / 1e6
+    loaded = [m for m in proc.stdout.strip().split(",") if m]
+    return dict(by_package), total, loaded
+
+def main():
+    parser = argparse.ArgumentParser(description="Where `import app` spends its time")
+    parser.add_argument("--top", type=int, default=12)
+    parser.add_argument("--with-model", action="store_true", help="also time the deferred model stack import")
+    args = parser.parse_args()
+
+    by_package, total, loaded = import_profile()
+    print(f"[startup_report] import app: {total:.2f}s")
+    for name, seconds in sorted(by_package.items(), key=lambda kv: -kv[1])[:args.top]:
+        print(f"[startup_report] {name:>24}: {seconds:6.3f}s ({seconds / total:5.1%})")
+    print(f"[startup_report] ML stack loaded at import: {loaded or 'none'}")
+
+    if args.with_model:
+        # what the first encode pays on top (import only, no weights)
+        _, deferred, _ = import_profile("alg", "; import sentence_transformers, sklearn.preprocessing")
+        _, base, _ = import_profile("alg")
+        print(f"[startup_report] deferred to first encode: {deferred - base:.2f}s")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,34 @@
+# the app modules live at the repo root
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+import pytest
+from scipy import sparse
+
+def random_matrices(n, seed=0):
+    # cohort shaped like alg.build_similarity_matrices output: unit rows per group
+    import alg
+    rng = np.random.default_rng(seed)
+    ndids = [f"{900000000 + i}" for i in range(n)]
+    matrices = {"ndids": ndids, "rows": {ndid: i for i, ndid in enumerate(ndids)}}
+    for g in alg.SIMILARITY_GROUPS:
+        block = {
+            "dense": rng.standard_normal((n, 8)),
+            "sparse": sparse.random(n, 12, density=0.2, format="csr", random_state=rng),
+        }
+        matrices[g] = alg.normalize_block(block)
+    return matrices
+
+@pytest.fixture
+def cohort(monkeypatch):
+    # alg state holding a 60-student cohort, shared snapshots off
+    import alg
+    monkeypatch.setattr(alg, "SNAPSHOT_DIR", "")
+    monkeypatch.setattr(alg, "_SNAPSHOTS", None)
+    for key in ("encoders", "matrices", "ann", "snapshot_version"):
+        monkeypatch.setitem(alg._STATE, key, None)
+    alg._set_state({"fit_id": "fit", "extensions": 0, "version": "fit.0"}, random_matrices(60))
+    return alg._STATE["matrices"]
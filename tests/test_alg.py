@@ -0,0 +1,108 @@
+import numpy as np
+from scipy import sparse
+
+import alg
+
+LAYOUT = {"dense": [("major", 3), ("minor", 2)], "sparse": [("courses", 4), ("year", 3)]}
+
+def _block(n=4, seed=0):
+    rng = np.random.default_rng(seed)
+    S = sparse.random(n, 7, density=0.4, format="csr", dtype=np.float32, random_state=seed)
+    return {"dense": rng.standard_normal((n, 5)).astype(np.float32), "sparse": S}
+
+def test_pack_row_layout():
+    block = _block()
+    S = block["sparse"]
+    blob = alg._pack_row(block, 1)
+    nnz = S.indptr[2] - S.indptr[1]
+    assert len(blob) == 4 * 5 + 8 * nnz
+    assert blob[:20] == block["dense"][1].astype(np.float32).tobytes()
+
+def test_pack_unpack_row_round_trip():
+    block = _block()
+    for i in range(4):
+        dense, indices, values = alg._unpack_row(alg._pack_row(block, i), 5)
+        row = block["sparse"][i]
+        np.testing.assert_array_equal(dense, block["dense"][i])
+        np.testing.assert_array_equal(indices, row.indices)
+        np.testing.assert_array_equal(values, row.data)
+
+def test_unpack_rows_rebuilds_block():
+    block = _block()
+    blobs = [alg._pack_row(block, i) for i in range(4)]
+    out = alg._unpack_rows(blobs, LAYOUT)
+    np.testing.assert_array_equal(out["dense"], block["dense"])
+    assert out["sparse"].shape == (4, 7)
+    np.testing.assert_array_equal(out["sparse"].toarray(), block["sparse"].toarray())
+
+def test_unpack_rows_empty():
+    out = alg._unpack_rows([], LAYOUT)
+    assert out["dense"].shape == (0, 5)
+    assert out["sparse"].shape == (0, 7)
+
+def test_pack_row_int8_block_is_dequantized():
+    block = _block()
+    scale = np.array([0.5, 2.0, 1.0, 0.25], dtype=np.float32)
+    q = {"dense": np.arange(20, dtype=np.int8).reshape(4, 5), "sparse": block["sparse"], "scale": scale}
+    dense, _, _ = alg._unpack_row(alg._pack_row(q, 1), 5)
+    np.testing.assert_allclose(dense, np.arange(5, 10) * 2.0)
+
+OLD = [("courses", 2), ("clubs", 3), ("year", 1)]
+NEW = [("courses", 4), ("clubs", 3), ("year", 2)]
+
+def test_pad_sparse_shifts_later_segments():
+    S = sparse.csr_matrix(np.array([[1, 2, 3, 4, 5, 6]], dtype=np.float32))
+    padded = alg._pad_sparse(S, OLD, NEW)
+    assert padded.shape == (1, 9)
+    np.testing.assert_array_equal(padded.toarray(), [[1, 2, 0, 0, 3, 4, 5, 6, 0]])
+
+def test_pad_sparse_same_widths_is_identity():
+    S = sparse.csr_matrix(np.eye(6, dtype=np.float32))
+    assert alg._pad_sparse(S, OLD, OLD) is S
+
+def test_truncate_sparse_inverts_pad():
+    S = sparse.random(5, 6, density=0.5, format="csr", dtype=np.float32, random_state=1)
+    restored = alg._truncate_sparse(alg._pad_sparse(S, OLD, NEW), NEW, OLD)
+    assert restored.shape == S.shape
+    np.testing.assert_array_equal(restored.toarray(), S.toarray())
+
+def test_truncate_sparse_drops_appended_columns():
+    S = sparse.csr_matrix(np.array([[1, 2, 7, 8, 3, 4, 5, 6, 9]], dtype=np.float32))
+    np.testing.assert_array_equal(alg._truncate_sparse(S, NEW, OLD).toarray(), [[1, 2, 3, 4, 5, 6]])
+
+def test_top_indices_matches_stable_sort():
+    rng = np.random.default_rng(2)
+    scores = rng.integers(0, 5, size=200).astype(np.float64)
+    full = np.argsort(-scores, kind="stable")
+    for k in (0, 1, 7, 50, 199, 200, 500):
+        np.testing.assert_array_equal(alg.top_indices(scores, k), full[:max(k, 0)])
+
+def test_top_indices_ties_prefer_lower_index():
+    scores = np.array([0.5, 0.9, 0.9, 0.1, 0.9])
+    np.testing.assert_array_equal(alg.top_indices(scores, 2), [1, 2])
+
+def test_lazy_ranking_pages_follow_full_order():
+    scores = np.array([0.2, 0.8, 0.8, 0.5, 0.8, 0.1])
+    ndids = list("abcdef")
+    ranking = alg.LazyRanking(ndids, {n: i for i, n in enumerate(ndids)}, scores, exclude_row=2)
+    expected = ["b", "e", "d", "a", "f"]
+    assert [n for n, _ in ranking.page(0, 2)] + [n for n, _ in ranking.page(2, 10)] == expected
+    assert [n for n, _ in ranking.all()] == expected
+
+def _exact(user_id, matrices, weights):
+    scores = alg.score_against_all(user_id, matrices, weights)
+    order = [i for i in np.argsort(-scores, kind="stable") if i != matrices["rows"][user_id]]
+    return [(matrices["ndids"][i], float(scores[i])) for i in order]
+
+def test_return_similarities_page(cohort):
+    user = cohort["ndids"][3]
+    weights = alg.DEFAULT_ALG_WEIGHTS
+    exact = _exact(user, cohort, weights)
+
+    page, total = alg.return_similarities_page(user, None, weights, 10, 12)
+    assert total == 59
+    assert page == exact[10:22]
+
+    page, total = alg.return_similarities_page(user, None, weights, 12, 12, n=20)
+    assert total == 20
+    assert page == exact[12:20]
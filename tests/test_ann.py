@@ -0,0 +1,90 @@
+import threading
+
+import numpy as np
+import pytest
+
+import alg
+from ann import IVFIndex
+
+WEIGHTS = alg.DEFAULT_ALG_WEIGHTS
+
+@pytest.fixture
+def large(cohort, monkeypatch):
+    # the 60-student cohort counts as large; encoders with an edit history
+    monkeypatch.setattr(alg, "ANN_MIN_STUDENTS", 50)
+    monkeypatch.setattr(alg, "_segment_widths", lambda encoders: {})
+    alg._set_state(dict(alg._STATE["encoders"], **alg._new_edit_log()), cohort)
+    return cohort
+
+def _wait_for_index():
+    builder = alg._ANN_BUILDER["thread"]
+    if builder is not None:
+        builder.join(10)
+    return alg._STATE["ann"]
+
+def test_index_is_built_off_the_request_path(large, monkeypatch):
+    built_on = []
+    build = IVFIndex.build
+
+    def spy(self, matrices):
+        built_on.append(threading.current_thread().name)
+        return build(self, matrices)
+
+    monkeypatch.setattr(IVFIndex, "build", spy)
+    user = large["ndids"][7]
+    page, total = alg.return_similarities_page(user, None, WEIGHTS, 0, 10, n=20)
+    assert total == 20 and len(page) == 10  # scored exactly meanwhile
+    index = _wait_for_index()
+    assert built_on == ["ann-build"]
+    assert index.generation == large["generation"]
+    assert alg.get_ann_index(large) is index
+
+def test_n_pages_use_the_index(large, monkeypatch):
+    alg.get_ann_index(large)
+    index = _wait_for_index()
+    queries = []
+    query = IVFIndex.query
+    monkeypatch.setattr(IVFIndex, "query", lambda self, *a, **kw: queries.append(a[-1]) or query(self, *a, **kw))
+    user = large["ndids"][7]
+    page, total = alg.return_similarities_page(user, None, WEIGHTS, 10, 10, n=20)
+    assert queries == [20]
+    assert total == 20 and len(page) <= 10
+
+    # no ?n=: the full ranking, never the approximate one
+    alg.return_similarities_page(user, None, WEIGHTS, 0, 10)
+    assert queries == [20]
+
+def test_index_follows_an_incremental_swap(large):
+    alg.get_ann_index(large)
+    index = _wait_for_index()
+
+    # what another worker publishes after deleting one student and editing another
+    gone, edited = large["ndids"][3], large["ndids"][10]
+    keep = np.array([n != gone for n in large["ndids"]])
+    ndids = [n for n in large["ndids"] if n != gone]
+    matrices = {"ndids": ndids, "rows": {n: i for i, n in enumerate(ndids)}}
+    for g in alg.SIMILARITY_GROUPS:
+        matrices[g] = alg.take_rows(large[g], keep)
+        matrices[g]["dense"] = matrices[g]["dense"].copy()
+        matrices[g]["dense"][matrices["rows"][edited]] *= -1
+    encoders = alg._touch(alg._touch(alg._STATE["encoders"], [gone]), [edited])
+    alg._set_state(encoders, matrices, snapshot_version="v2", keep_index=True)
+
+    carried = alg._STATE["ann"]
+    assert carried is not None and carried is not index
+    assert carried.generation == matrices["generation"]
+    old = {n: index.assign[i] for i, n in enumerate(large["ndids"])}
+    for i, n in enumerate(ndids):
+        if n != edited:
+            assert carried.assign[i] == old[n]
+    fresh = IVFIndex.__new__(IVFIndex)
+    fresh.__dict__.update(carried.__dict__)
+    fresh.assign_rows(matrices, [matrices["rows"][edited]])
+    assert carried.assign[matrices["rows"][edited]] == fresh.assign[matrices["rows"][edited]]
+
+def test_index_dropped_after_a_new_fit(large):
+    alg.get_ann_index(large)
+    _wait_for_index()
+    encoders = dict(alg._STATE["encoders"], fit_id="refit", **alg._new_edit_log())
+    alg._set_state(encoders, dict(large), keep_index=True)
+    assert alg._STATE["ann"] is None
@@ -0,0 +1,38 @@
+import base64
+import json
+
+import app
+
+def test_cursor_round_trip():
+    cursor = app.encode_cursor("abc.3", "1.0,0.5,0.0", 150)
+    assert "=" not in cursor
+    assert app.decode_cursor(cursor) == {"v": "abc.3", "w": "1.0,0.5,0.0", "o": 150}
+
+def test_cursor_is_url_safe():
+    cursor = app.encode_cursor("?" * 40 + ">" * 40, "~~~", 0)
+    assert set(cursor) <= set("ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789-_")
+    assert app.decode_cursor(cursor)["v"] == "?" * 40 + ">" * 40
+
+def _raw(state):
+    return base64.urlsafe_b64encode(json.dumps(state).encode()).decode().rstrip("=")
+
+def test_decode_cursor_rejects_garbage():
+    assert app.decode_cursor("not a cursor!") is None
+    assert app.decode_cursor("") is None
+    assert app.decode_cursor(_raw([1, 2])) is None
+    assert app.decode_cursor(_raw({"v": "x", "w": "y"})) is None
+    assert app.decode_cursor(_raw({"v": "x", "w": "y", "o": -1})) is None
+    assert app.decode_cursor(_raw({"v": "x", "w": "y", "o": "10"})) is None
+
+def test_embeddings_status_reports_loaded_models(monkeypatch):
+    import model_registry
+    monkeypatch.setitem(model_registry._STATS, "all-MiniLM-L6-v2", {
+        "source": "local", "precision": "float32", "load_seconds": 1.5,
+        "param_bytes": 90_000_000, "max_rss_growth_bytes": 120_000_000, "warmup_seconds": None,
+    })
+    client = app.app.test_client()
+    with client.session_transaction() as session:
+        session["NDID"] = "900000001"
+    status = client.get("/api/embeddings/status").get_json()
+    assert status["models"]["all-MiniLM-L6-v2"]["param_bytes"] == 90_000_000
+    assert "queue_depth" in status
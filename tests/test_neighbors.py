@@ -0,0 +1,97 @@
+import numpy as np
+import pytest
+
+import alg
+import neighbors
+
+WEIGHTS = alg.DEFAULT_ALG_WEIGHTS
+
+@pytest.fixture
+def table(cohort, monkeypatch):
+    # batch neighbour table for the cohort, served through a stubbed load_neighbors
+    alg._set_state(dict(alg._STATE["encoders"], **alg._new_edit_log()), cohort)
+    result = neighbors.compute_neighbors(cohort, k=alg.NEIGHBOR_K)
+    idx, scores = result["default"]
+    stamp = alg.neighbor_stamp(alg._STATE["encoders"])
+    rows = {
+        ndid: (stamp, [(cohort["ndids"][j], float(s)) for j, s in zip(idx[i], scores[i]) if j >= 0])
+        for i, ndid in enumerate(cohort["ndids"])
+    }
+    monkeypatch.setattr(alg, "load_neighbors", lambda ndid, engine, group="default", k=alg.NEIGHBOR_K: (
+        rows.get(ndid, (None, []))[0], rows.get(ndid, (None, []))[1][:k]
+    ))
+    return rows
+
+def _exact(user_id, matrices):
+    scores = alg.score_against_all(user_id, matrices, WEIGHTS)
+    order = [i for i in np.argsort(-scores, kind="stable") if i != matrices["rows"][user_id]]
+    return [(matrices["ndids"][i], float(scores[i])) for i in order]
+
+def _assert_same(page, expected):
+    assert [ndid for ndid, _ in page] == [ndid for ndid, _ in expected]
+    np.testing.assert_allclose([s for _, s in page], [s for _, s in expected], rtol=1e-5)
+
+def _no_full_scoring(monkeypatch):
+    def fail(*args, **kwargs):
+        raise AssertionError("scored the whole cohort")
+    monkeypatch.setattr(alg, "cached_group_scores", fail)
+
+def _set_row(ndid, like):
+    # copy of the state with ndid's vectors replaced by those of `like`
+    matrices = dict(alg._STATE["matrices"])
+    rows = matrices["rows"]
+    for g in alg.SIMILARITY_GROUPS:
+        dense = matrices[g]["dense"].copy()
+        dense[rows[ndid]] = dense[rows[like]]
+        S = matrices[g]["sparse"].tolil()
+        S[rows[ndid]] = S[rows[like]]
+        matrices[g] = dict(matrices[g], dense=dense, sparse=S.tocsr())
+    alg._set_state(alg._touch(alg._STATE["encoders"], [ndid]), matrices)
+
+def test_first_pages_come_from_the_table(table, cohort, monkeypatch):
+    user = cohort["ndids"][5]
+    expected = _exact(user, cohort)
+    _no_full_scoring(monkeypatch)
+    page, total = alg.return_similarities_page(user, "db", WEIGHTS, 0, 12)
+    assert total == 59
+    _assert_same(page, expected[:12])
+    page, _ = alg.return_similarities_page(user, "db", WEIGHTS, 12, 12, n=30)
+    _assert_same(page, expected[12:24])
+
+def test_edited_student_is_scored_live(table, cohort, monkeypatch):
+    user, edited = cohort["ndids"][5], cohort["ndids"][40]
+    _set_row(edited, like=user)
+    expected = _exact(user, alg._STATE["matrices"])
+    assert expected[0][0] == edited
+    _no_full_scoring(monkeypatch)
+    page, _ = alg.return_similarities_page(user, "db", WEIGHTS, 0, 12)
+    _assert_same(page, expected[:12])
+
+def test_deleted_neighbour_is_dropped(table, cohort, monkeypatch):
+    user = cohort["ndids"][5]
+    gone = table[user][1][0][0]
+    alg.remove_student_embedding(gone)
+    expected = _exact(user, alg._STATE["matrices"])
+    _no_full_scoring(monkeypatch)
+    page, total = alg.return_similarities_page(user, "db", WEIGHTS, 0, 12)
+    assert total == 58
+    assert gone not in [ndid for ndid, _ in page]
+    _assert_same(page, expected[:12])
+
+def test_table_not_used_when_it_cannot_answer(table, cohort):
+    user = cohort["ndids"][5]
+    encoders = alg._STATE["encoders"]
+    matrices = alg._STATE["matrices"]
+    assert alg.stored_neighbors(user, matrices, encoders, "db", alg.NEIGHBOR_K + 1) is None
+    assert alg.stored_neighbors(user, matrices, dict(encoders, label_refresh=encoders["edits"] + 1), "db", 10) is None
+    assert alg.stored_neighbors(user, matrices, dict(encoders, edit_epoch="other"), "db", 10) is None
+    assert alg.stored_neighbors(user, matrices, alg._touch(encoders, [user]), "db", 10) is None
+    assert alg.stored_neighbors(user, matrices, encoders, "db", 10) is not None
+
+def test_custom_weights_are_scored_exactly(table, cohort):
+    user = cohort["ndids"][5]
+    weights = dict(WEIGHTS, academics=0.1)
+    page, _ = alg.return_similarities_page(user, "db", weights, 0, 10)
+    scores = alg.score_against_all(user, cohort, weights)
+    order = [i for i in np.argsort(-scores, kind="stable") if i != cohort["rows"][user]]
+    assert [ndid for ndid, _ in page] == [cohort["ndids"][i] for i in order[:10]]
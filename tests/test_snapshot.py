@@ -0,0 +1,80 @@
+import numpy as np
+import pytest
+from scipy import sparse
+
+import snapshot
+
+GROUPS = ("academics", "background")
+
+def _matrices(n=6):
+    rng = np.random.default_rng(0)
+    matrices = {"ndids": [f"s{i}" for i in range(n)]}
+    matrices["academics"] = {
+        "dense": rng.standard_normal((n, 4)).astype(np.float32),
+        "sparse": sparse.random(n, 9, density=0.3, format="csr", dtype=np.float32, random_state=0),
+    }
+    matrices["background"] = {
+        "dense": rng.integers(-127, 128, size=(n, 3)).astype(np.int8),
+        "sparse": sparse.random(n, 2, density=0.5, format="csr", dtype=np.float32, random_state=1),
+        "scale": rng.random(n).astype(np.float32),
+    }
+    return matrices
+
+def test_snapshot_round_trip(tmp_path):
+    path = str(tmp_path / "snap.bin")
+    matrices = _matrices()
+    snapshot.write_snapshot(path, "v1", matrices, GROUPS, payload=b"encoders", meta={"k": 1})
+    header, loaded, payload = snapshot.read_snapshot(path)
+
+    assert header["version"] == "v1"
+    assert header["meta"] == {"k": 1}
+    assert payload == b"encoders"
+    assert loaded["ndids"] == matrices["ndids"]
+    assert loaded["rows"] == {n: i for i, n in enumerate(matrices["ndids"])}
+    for g in GROUPS:
+        np.testing.assert_array_equal(loaded[g]["dense"], matrices[g]["dense"])
+        assert loaded[g]["dense"].dtype == matrices[g]["dense"].dtype
+        assert loaded[g]["sparse"].shape == matrices[g]["sparse"].shape
+        np.testing.assert_array_equal(loaded[g]["sparse"].toarray(), matrices[g]["sparse"].toarray())
+    np.testing.assert_array_equal(loaded["background"]["scale"], matrices["background"]["scale"])
+    assert "scale" not in loaded["academics"]
+
+def test_snapshot_arrays_are_aligned_read_only_views(tmp_path):
+    path = str(tmp_path / "snap.bin")
+    snapshot.write_snapshot(path, "v1", _matrices(), GROUPS)
+    header, loaded, payload = snapshot.read_snapshot(path)
+
+    assert payload == b""
+    assert all(spec["offset"] % snapshot.ALIGN == 0 for spec in header["arrays"].values())
+    assert not loaded["academics"]["dense"].flags.writeable
+
+def test_snapshot_empty_cohort(tmp_path):
+    path = str(tmp_path / "snap.bin")
+    matrices = _matrices(0)
+    snapshot.write_snapshot(path, "v0", matrices, GROUPS)
+    _, loaded, _ = snapshot.read_snapshot(path)
+    assert loaded["ndids"] == []
+    assert loaded["academics"]["dense"].shape == (0, 4)
+    assert loaded["academics"]["sparse"].shape == (0, 9)
+
+def test_read_snapshot_rejects_other_files(tmp_path):
+    path = tmp_path / "other.bin"
+    path.write_bytes(b"not a snapshot at all")
+    with pytest.raises(ValueError):
+        snapshot.read_snapshot(str(path))
+
+def test_store_publish_and_poll(tmp_path):
+    writer = snapshot.SnapshotStore(str(tmp_path))
+    reader = snapshot.SnapshotStore(str(tmp_path))
+    assert reader.poll() is None
+
+    writer.publish("v1", _matrices(), GROUPS)
+    header, loaded, _ = reader.poll()
+    assert header["version"] == "v1" and reader.version == "v1"
+    assert reader.poll() is None
+
+    writer.publish("v2", _matrices(3), GROUPS)
+    header, loaded, _ = reader.poll()
+    assert header["version"] == "v2"
+    assert loaded["ndids"] == ["s0", "s1", "s2"]
+    assert writer.current_version() == "v2"
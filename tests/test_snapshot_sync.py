@@ -0,0 +1,78 @@
+import pickle
+import threading
+import time
+import types
+
+import numpy as np
+import pytest
+from scipy import sparse
+
+import alg
+import snapshot
+
+ENCODERS = {"fit_id": "fit", "extensions": 0, "version": "fit.0"}
+
+def _matrices(ndids):
+    rng = np.random.default_rng(len(ndids))
+    matrices = {"ndids": list(ndids), "rows": {n: i for i, n in enumerate(ndids)}}
+    for g in alg.SIMILARITY_GROUPS:
+        matrices[g] = {
+            "dense": rng.standard_normal((len(ndids), 3)).astype(np.float32),
+            "sparse": sparse.csr_matrix((len(ndids), 2), dtype=np.float32),
+        }
+    return matrices
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    monkeypatch.setattr(alg, "_SNAPSHOTS", snapshot.SnapshotStore(str(tmp_path)))
+    for key in ("encoders", "matrices", "ann", "snapshot_version"):
+        monkeypatch.setitem(alg._STATE, key, None)
+    alg._set_state(dict(ENCODERS), _matrices(["s0", "s1", "s2"]))
+    with alg._snapshot_lock():
+        alg._publish_snapshot(alg._STATE["encoders"], alg._STATE["matrices"])
+    return alg._SNAPSHOTS
+
+def test_writer_waits_for_a_sync_in_progress(store, monkeypatch):
+    # another process publishes X (adds s3) while this one removes s1
+    other = snapshot.SnapshotStore(store.directory)
+    other.publish(
+        "x", _matrices(["s0", "s1", "s2", "s3"]), alg.SIMILARITY_GROUPS,
+        payload=pickle.dumps(ENCODERS), meta={"layout_format": alg.LAYOUT_FORMAT},
+    )
+
+    unpickling = threading.Event()
+
+    def slow_loads(data):
+        unpickling.set()
+        time.sleep(0.3)
+        return pickle.loads(data)
+
+    monkeypatch.setattr(alg, "pickle", types.SimpleNamespace(
+        loads=slow_loads, dumps=pickle.dumps, HIGHEST_PROTOCOL=pickle.HIGHEST_PROTOCOL,
+    ))
+    reader = threading.Thread(target=alg.sync_snapshot)
+    reader.start()
+    assert unpickling.wait(5)
+    alg.remove_student_embedding("s1")
+    reader.join()
+
+    _, published, _ = snapshot.read_snapshot(store._path(f"{store.current_version()}.snap"))
+    assert published["ndids"] == ["s0", "s2", "s3"]
+    assert alg._STATE["matrices"]["ndids"] == ["s0", "s2", "s3"]
+    assert alg._STATE["snapshot_version"] == store.current_version()
+
+def test_failed_sync_is_retried(store, monkeypatch):
+    other = snapshot.SnapshotStore(store.directory)
+    other.publish(
+        "x", _matrices(["s0", "s1", "s2", "s3"]), alg.SIMILARITY_GROUPS,
+        payload=pickle.dumps(ENCODERS), meta={"layout_format": alg.LAYOUT_FORMAT},
+    )
+
+    def broken_loads(data):
+        raise pickle.UnpicklingError("truncated")
+
+    monkeypatch.setattr(alg, "pickle", types.SimpleNamespace(loads=broken_loads))
+    assert not alg.sync_snapshot()
+    monkeypatch.setattr(alg, "pickle", pickle)
+    assert alg.sync_snapshot()
+    assert alg._STATE["snapshot_version"] == "x"
@@ -0,0 +1,147 @@
+# compact storage for the dense part of each similarity block: float16, or int8 with a per-row scale
+import argparse
+import os
+import time
+import numpy as np
+
+# "float32", "float16" or "int8" (+ float32 scale per row); "" keeps whatever the
+# producer made (float64 when encoded here, float32 when mapped from a snapshot)
+STORAGES = ("float64", "float32", "float16", "int8")
+VECTOR_STORAGE = os.environ.get("VECTOR_STORAGE", "")
+
+# rows widened to float32 at a time by the scoring kernels (keeps the temporary in cache)
+SCORE_CHUNK = int(os.environ.get("VECTOR_SCORE_CHUNK", "4096"))
+
+GROUPS = ("academics", "professional", "background")
+
+def storage_of(block):
+    if block.get("scale") is not None:
+        return "int8"
+    return np.dtype(block["dense"].dtype).name
+
+def dense_rows(block, rows=slice(None)):
+    # dense rows as floats (float32 unless stored wider); a single int row gives a 1-D vector
+    D = block["dense"][rows]
+    scale = block.get("scale")
+    if scale is not None:
+        return D.astype(np.float32) * np.asarray(scale[rows], dtype=np.float32)[..., None]
+    if D.dtype == np.float16:
+        return D.astype(np.float32)
+    return D
+
+def dense_dot(block, u, rows=None):
+    # dense rows @ u straight from the compact form; int8 rows are scaled after the product
+    D = block["dense"] if rows is None else block["dense"][rows]
+    scale = block.get("scale")
+    if scale is None and D.dtype != np.float16:
+        return D @ u
+    u = np.asarray(u, dtype=np.float32)
+    out = np.empty(D.shape[0], dtype=np.float32)
+    for start in range(0, D.shape[0], SCORE_CHUNK):
+        stop = min(D.shape[0], start + SCORE_CHUNK)
+        out[start:stop] = D[start:stop].astype(np.float32) @ u
+    if scale is not None:
+        out *= scale if rows is None else scale[rows]
+    return out
+
+def compact_block(block, storage=VECTOR_STORAGE):
+    # same block in `storage`; returned as is when already stored that way (keeps mmap views)
+    if storage and storage not in STORAGES:
+        raise ValueError(f"Unknown vector storage: {storage}")
+    if not storage or storage_of(block) == storage:
+        return block
+    D = dense_rows(block)
+    S = block["sparse"]
+    if storage != "float64" and S.dtype != np.float32:
+        S = S.astype(np.float32)  # scipy has no float16 sparse; label columns stay float32
+
+    if storage == "int8":
+        scale = np.abs(D).max(axis=1) / 127.0 if D.shape[1] else np.ones(D.shape[0])
+        scale[scale == 0] = 1.0
+        q = np.rint(D / scale[:, None]).astype(np.int8)
+        return {"dense": q, "sparse": S, "scale": scale.astype(np.float32)}
+    return {"dense": np.ascontiguousarray(D, dtype=storage), "sparse": S}
+
+def take_rows(block, rows):
+    out = {"dense": block["dense"][rows], "sparse": block["sparse"][rows]}
+    if block.get("scale") is not None:
+        out["scale"] = block["scale"][rows]
+    return out
+
+def block_nbytes(block):
+    S = block["sparse"]
+    total = block["dense"].nbytes + S.data.nbytes + S.indices.nbytes + S.indptr.nbytes
+    if block.get("scale") is not None:
+        total += block["scale"].nbytes
+    return total
+
+# -- Benchmark --
+def _scores(matrices, row, weights):
+    active = [(g, w) for g, w in weights.items() if w > 0]
+    scores = np.zeros(len(matrices["ndids"]))
+    for g, w in active:
+        block = matrices[g]
+        scores += w * (dense_dot(block, dense_rows(block, row)) + block["sparse"] @ block["sparse"][row].toarray().ravel())
+    return scores / sum(w for _, w in active)
+
+def benchmark(matrices, storages=STORAGES, k=10, n_queries=100, seed=0):
+    # per storage: bytes held, ms per full scoring pass, top-k overlap and score drift vs float64
+    weights = {g: 1.0 for g in GROUPS}
+    rng = np.random.default_rng(seed)
+    N = len(matrices["ndids"])
+    queries = rng.choice(N, size=min(n_queries, N), replace=False)
+    k = max(1, min(k, N - 1))
+
+    reference = {g: compact_block(matrices[g], "float64") for g in GROUPS}
+    reference.update(ndids=matrices["ndids"])
+    exact = {}
+    for q in queries:
+        s = _scores(reference, q, weights)
+        s[q] = -np.inf
+        exact[q] = s
+
+    results = {}
+    for storage in storages:
+        compact = {g: compact_block(reference[g], storage) for g in GROUPS}
+        compact.update(ndids=matrices["ndids"])
+        overlap = drift = 0.0
+        t0 = time.perf_counter()
+        runs = [(q, _scores(compact, q, weights)) for q in queries]
+        ms = (time.perf_counter() - t0) / len(queries) * 1000
+        for q, s in runs:
+            s[q] = -np.inf
+            ref = exact[q]
+            top_ref = set(np.argpartition(-ref, k - 1)[:k].tolist())
+            top = set(np.argpartition(-s, k - 1)[:k].tolist())
+            overlap += len(top_ref & top) / k
+            finite = np.isfinite(ref)
+            drift = max(drift, float(np.abs(s[finite] - ref[finite]).max()))
+        results[storage] = {
+            "bytes": sum(block_nbytes(compact[g]) for g in GROUPS),
+            "ms_per_query": ms,
+            f"overlap@{k}": overlap / len(queries),
+            "max_score_drift": drift,
+        }
+        r = results[storage]
+        print(f"[vector_storage] {storage:>7}: {r['bytes'] / 2**20:8.1f} MiB  {ms:7.2f} ms/query  "
+              f"overlap@{k}={r[f'overlap@{k}']:.3f}  max drift={drift:.2e}")
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description="Memory / ranking drift of compact vector storage")
+    parser.add_argument("--synthetic", type=int, default=0, help="benchmark on N random students instead of the DB")
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--queries", type=int, default=100)
+    args = parser.parse_args()
+
+    if args.synthetic:
+        from ann import synthetic_matrices
+        matrices = synthetic_matrices(args.synthetic)
+    else:
+        from sqlalchemy import create_engine
+        import alg
+        _, matrices = alg.get_similarity_state(create_engine(alg.DATABASE_URI, future=True))
+    benchmark(matrices, k=args.k, n_queries=args.queries)
+
+if __name__ == "__main__":
+    main()